@@ -0,0 +1,355 @@
+"""
+Cache delle risposte - Partner Data
+Riutilizza le risposte a domande già poste (anche formulate in modo leggermente diverso)
+senza rifare il giro Claude + OS1.
+
+Chiave: entità risolte dalla domanda (cliente, anno/mese/periodo, tipo e stato documento,
+tipo di aggregazione, tutti i numeri, negazioni e confronti), che devono coincidere
+esattamente, + testo normalizzato. Anche le parole di contenuto devono essere le stesse (a
+meno di sinonimi noti): la similarità testuale locale (difflib, nessun servizio esterno)
+copre solo ordine delle parole e parole vuote.
+Una risposta resta valida finché i dati OS1 (e gli snapshot KPI) da cui è stata ricavata
+non cambiano.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import date
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.85"))
+ANSWER_CACHE_MAX_ENTRIES = 300
+
+STOPWORDS = {
+    "il", "lo", "la", "i", "gli", "le", "l", "un", "uno", "una", "di", "a", "da", "in",
+    "con", "su", "per", "tra", "fra", "del", "dello", "della", "dei", "degli", "delle",
+    "dell", "al", "allo", "alla", "ai", "agli", "alle", "all", "dal", "dalla", "dai",
+    "dalle", "nel", "nella", "nei", "negli", "nelle", "nell", "sul", "sulla", "sui",
+    "sulle", "e", "ed", "o", "che", "mi", "ci", "c", "ti", "si", "me", "puoi", "dammi",
+    "mostrami", "fammi", "vedere", "favore", "sono", "ha", "hanno", "quali", "quale", "qual",
+    "cosa", "dimmi", "vorrei", "sapere", "mostra", "visualizza", "indica", "stati", "stato",
+}
+
+# Parole chiave → tipo di documento OS1
+DOC_TYPES = {
+    "fatture": ("fattur", "nota credito", "note credito", "note di credito"),
+    "offerte": ("offert", "preventiv"),
+    "ordini": ("ordin",),
+    "bolle": ("bolle", "bolla", "ddt", "consegn", "spedizion"),
+}
+
+MESI = (
+    "gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno", "luglio",
+    "agosto", "settembre", "ottobre", "novembre", "dicembre",
+)
+PERIODI_ANNO = re.compile(
+    r"\b(primo|secondo|terzo|quarto|[1-4])\s*(trimestre|semestre)\b|\bq([1-4])\b"
+)
+ORDINALI = {"primo": "1", "secondo": "2", "terzo": "3", "quarto": "4"}
+
+# Prefissi di parola → stato documento (devono coincidere, "inevasi" ≠ "evasi")
+STATI = (
+    ("inevas", "inevaso"),
+    ("apert", "inevaso"),
+    ("sollecit", "da sollecitare"),
+    ("parzial", "evaso parzialmente"),
+    ("evas", "evaso"),
+    ("chius", "evaso"),
+    ("totalment", "evaso"),
+)
+
+# Prefissi di parola → tipo di aggregazione richiesta
+AGGREGAZIONI = (
+    ("fatturat", "totale"),
+    ("totale", "totale"),
+    ("totali", "totale"),
+    ("somm", "totale"),
+    ("complessiv", "totale"),
+    ("medi", "media"),
+    ("quant", "conteggio"),
+    ("numer", "conteggio"),
+    ("massim", "massimo"),
+    ("maggior", "massimo"),
+    ("minim", "minimo"),
+    ("minor", "minimo"),
+    ("andament", "andamento"),
+    ("trend", "andamento"),
+    ("mensil", "andamento"),
+    ("confront", "confronto"),
+    ("rispetto", "confronto"),
+    ("elenc", "elenco"),
+    ("list", "elenco"),
+    ("dettagl", "elenco"),
+)
+
+# Negazioni e confronti: cambiano il significato anche se il resto della domanda è uguale
+QUALIFICATORI = {
+    "non": "non", "senza": "non", "nessun": "non", "nessuno": "non", "nessuna": "non",
+    "mai": "non",
+    "sopra": "maggiore", "oltre": "maggiore", "superiore": "maggiore", "superiori": "maggiore",
+    "almeno": "maggiore", "piu": "maggiore",
+    "sotto": "minore", "inferiore": "minore", "inferiori": "minore", "meno": "minore",
+    "entro": "minore",
+    "tra": "tra", "fra": "tra",
+}
+# Estremi di un intervallo di date ("dal 2022 al 2024" ≠ "nel 2022 e nel 2024")
+_MESI_RE = "|".join(MESI)
+INIZIO_INTERVALLO = re.compile(rf"\b(?:da|dal|dall|dalla|dai|dopo)\s+(?:\d|{_MESI_RE})")
+FINE_INTERVALLO = re.compile(rf"\b(?:al|all|alla|ai|fino|prima)\s+(?:\d|{_MESI_RE})")
+
+# Sinonimi noti per il confronto delle parole di contenuto
+SINONIMI = {
+    "valore": "importo", "ammontare": "importo", "cifra": "importo", "importi": "importo",
+    "doc": "documenti",
+}
+
+# Espressioni di periodo relative a oggi: la risposta vale solo per la giornata
+RELATIVE_PERIOD = re.compile(
+    r"\b(ultim[oiae]|scors[oiae]|quest[oa']|oggi|ieri|attual[ie]|recent[ie]|da sollecitare)\b"
+)
+
+
+def _strip_accents(text):
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+    )
+
+
+def normalize_question(text):
+    """Minuscolo, senza accenti, punteggiatura e parole vuote."""
+    text = _strip_accents(text.lower())
+    text = re.sub(r"[^\w\s]", " ", text)
+    tokens = [t for t in text.split() if t not in STOPWORDS]
+    return " ".join(tokens)
+
+
+def _match_prefissi(words, prefissi):
+    return tuple(sorted({
+        valore for word in words for prefisso, valore in prefissi if word.startswith(prefisso)
+    }))
+
+
+def _parola_canonica(word):
+    """Forma canonica di una parola: sinonimo noto, stato/aggregazione/tipo documento o radice."""
+    if word in SINONIMI:
+        return SINONIMI[word]
+    for gruppo, prefissi in (("stato", STATI), ("aggregazione", AGGREGAZIONI)):
+        for prefisso, valore in prefissi:
+            if word.startswith(prefisso):
+                return f"{gruppo}:{valore}"
+    for tipo, parole in DOC_TYPES.items():
+        if any(word.startswith(p) for p in parole if " " not in p):
+            return f"tipo:{tipo}"
+    # Singolare/plurale: "tessera" = "tessere"
+    return word[:-1] if len(word) > 3 and word[-1] in "aeio" else word
+
+
+@lru_cache(maxsize=1024)
+def content_words(normalized):
+    """Parole di contenuto (canoniche) della domanda normalizzata; i numeri sono nelle entità."""
+    return frozenset(_parola_canonica(w) for w in normalized.split() if not w.isdigit())
+
+
+def extract_entities(text):
+    """
+    Entità "risolte" dalla domanda: cliente, anni, mesi/trimestri, periodo relativo,
+    tipi e stati di documento, aggregazione, numeri, negazioni/confronti ed estremi di
+    intervallo. Tutte devono coincidere per un hit.
+    Restituisce None se non c'è un cliente: la domanda dipende dal contesto della chat
+    (es. "e nel 2023?") e non è cacheabile.
+    """
+    lower = _strip_accents(text.lower())
+    match = re.search(r"\bcliente\s+([\w.&'-]+)", lower) or re.search(
+        r"\bcodice\s+(\d+)", lower
+    )
+    if not match:
+        return None
+
+    cliente = match.group(1).strip(".'-")
+    words = re.findall(r"\w+", lower)
+    anni = sorted(set(re.findall(r"\b(?:19|20)\d{2}\b", lower)))
+    mesi = sorted({mese for mese in MESI if mese in words})
+    for ordinale, tipo, quarter in PERIODI_ANNO.findall(lower):
+        if quarter:
+            mesi.append(f"{quarter} trimestre")
+        else:
+            mesi.append(f"{ORDINALI.get(ordinale, ordinale)} {tipo}")
+    periodo = re.findall(r"\b\d+\s+(?:giorni|settimane|mesi|anni)\b", lower)
+    if periodo or RELATIVE_PERIOD.search(lower):
+        # Periodo relativo: valido solo oggi
+        periodo.append(date.today().isoformat())
+    tipi = sorted(
+        tipo for tipo, parole in DOC_TYPES.items() if any(p in lower for p in parole)
+    )
+    stati = _match_prefissi(words, STATI)
+    aggregazioni = _match_prefissi(words, AGGREGAZIONI)
+    # Tutti i numeri (importi, agenti, quantità...), esclusi i trimestri già in "mesi"
+    numeri = tuple(sorted({
+        n.replace(".", "").replace(",", ".")
+        for n in re.findall(r"\b\d+(?:[.,]\d+)*\b", PERIODI_ANNO.sub(" ", lower))
+    }))
+    qualificatori = {QUALIFICATORI[w] for w in words if w in QUALIFICATORI}
+    if INIZIO_INTERVALLO.search(lower):
+        qualificatori.add("da")
+    if FINE_INTERVALLO.search(lower):
+        qualificatori.add("fino a")
+    return (cliente, tuple(anni), tuple(mesi), tuple(periodo), tuple(tipi), stati, aggregazioni,
+            numeri, tuple(sorted(qualificatori)))
+
+
+def similarity(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+
+class AnswerCache:
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # (entità, domanda normalizzata) -> {"answer", "deps", "kpi_deps", "created"}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "entries": len(self._entries),
+        }
+
+    def _best_match(self, entities, normalized):
+        """
+        Voce con le stesse entità e parole di contenuto e testo più simile sopra soglia,
+        o (None, None). Una parola presente in una sola delle due domande (es. "RFID" e
+        "combo") è un miss anche se il testo è quasi uguale.
+        """
+        best_key, best_score = None, self.threshold
+        parole = content_words(normalized)
+        with self._lock:
+            for key in self._entries:
+                if key[0] != entities or content_words(key[1]) != parole:
+                    continue
+                score = 1.0 if key[1] == normalized else similarity(key[1], normalized)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            return best_key, self._entries.get(best_key)
+
+    def lookup(self, question, os1_client):
+        """
+        Risposta in cache per una domanda equivalente, se i dati OS1 da cui deriva
+        sono invariati. None altrimenti: la voce viene rimossa solo se i dati sono
+        cambiati, non se non è verificabile (OS1 non raggiungibile, breaker aperto o
+        errore nel rileggere una dipendenza). Le dipendenze vengono riscaricate da OS1
+        solo se la loro risposta in cache è scaduta.
+        """
+        entities = extract_entities(question)
+        if entities is None:
+            return None
+
+        key, entry = self._best_match(entities, normalize_question(question))
+        if entry is not None and os1_client.breaker.is_open:
+            # OS1 giù: verificare le dipendenze vorrebbe dire pagare i timeout prima di Claude
+            entry = None
+        if entry is not None:
+            changed = False
+            for current, digest in self._current_digests(entry, os1_client):
+                if current is None:
+                    break  # non verificabile: miss, ma la voce resta
+                if current != digest:
+                    changed = True
+                    break
+            else:
+                with self._lock:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                return entry["answer"]
+
+            if changed:
+                with self._lock:
+                    self._entries.pop(key, None)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    @staticmethod
+    def _kpi_fingerprint(os1_client, id_cliente):
+        # Import lazy: lo store KPI serve solo se la risposta dipende da uno snapshot
+        from kpi_clienti import get_store
+        return get_store(os1_client).fingerprint(os1_client, id_cliente)
+
+    @staticmethod
+    def _digest(func, *args):
+        """Hash attuale di una dipendenza, None se non verificabile (qualsiasi errore)."""
+        try:
+            return func(*args)
+        except Exception as e:
+            # Es. 4xx o JSON non valido: la domanda deve comunque arrivare a Claude
+            logger.warning(f"Verifica dipendenza {args} fallita: {e}")
+            return None
+
+    def _current_digests(self, entry, os1_client):
+        """Coppie (hash attuale, hash salvato) per ogni dipendenza della voce, in modo lazy."""
+        for endpoint, params, digest in entry["deps"]:
+            yield self._digest(os1_client.fingerprint, endpoint, params), digest
+        for id_cliente, digest in entry["kpi_deps"]:
+            yield self._digest(self._kpi_fingerprint, os1_client, id_cliente), digest
+
+    def store(self, question, answer, os1_client, request_log):
+        """
+        Salva la risposta con le sue dipendenze (chiamate OS1 e snapshot KPI). Non salva
+        risposte basate su dati vecchi (OS1 non raggiungibile), su chiamate fallite o
+        senza dati.
+        """
+        entities = extract_entities(question)
+        kpi_clienti = sorted(set(request_log.kpi_clienti))
+        if (entities is None or request_log.stale or request_log.failed
+                or not (request_log.requests or kpi_clienti)):
+            return
+
+        deps = []
+        seen = set()
+        for endpoint, params in request_log.requests:
+            ident = (endpoint, tuple(sorted((params or {}).items())))
+            if ident in seen:
+                continue
+            seen.add(ident)
+            digest = self._digest(os1_client.fingerprint, endpoint, params)
+            if digest is None:
+                return
+            deps.append((endpoint, params, digest))
+
+        kpi_deps = []
+        for id_cliente in kpi_clienti:
+            digest = self._digest(self._kpi_fingerprint, os1_client, id_cliente)
+            if digest is None:
+                return
+            kpi_deps.append((id_cliente, digest))
+
+        key = (entities, normalize_question(question))
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer, "deps": deps, "kpi_deps": kpi_deps, "created": time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -5,17 +5,135 @@ Requisito: connessione VPN attiva verso 192.168.0.224
 """
 
 import requests
+import os
+import json
 import time
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from cache_os1 import DiskCache, make_cache_key
 
 logger = logging.getLogger(__name__)
 
+# Cache risposte: TTL in secondi e percorso opzionale del file SQLite su disco
+CACHE_TTL = int(os.getenv("OS1_CACHE_TTL", "900"))
+CACHE_PATH = os.getenv("OS1_CACHE_PATH")
+CACHE_MAX_MB = int(os.getenv("OS1_CACHE_MAX_MB", "50"))
+# Fino a quanto tempo (secondi) si possono servire dati scaduti se OS1 non risponde
+CACHE_STALE_TTL = int(os.getenv("OS1_CACHE_STALE_TTL", str(7 * 24 * 3600)))
+MEMORY_CACHE_MAX_ENTRIES = 500
+
+# Circuit breaker: dopo N errori di connessione/timeout consecutivi smette di chiamare OS1 per
+# un po'. N > 1 così un singolo timeout su una query lenta non blocca OS1 per tutte le sessioni.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("OS1_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = 60
+
+OS1_NON_RAGGIUNGIBILE = (
+    "Connessione a OS1 fallita. Assicurati che la VPN OpenVPN sia attiva "
+    "e che il server 192.168.0.224 sia raggiungibile."
+)
+
+
+class CircuitBreaker:
+    """
+    Evita di pagare timeout (10s auth, 30s GET) ad ogni tool call durante un disservizio.
+    closed → open dopo failure_threshold errori; dopo cooldown lascia passare una
+    sola chiamata di prova (half-open): se riesce torna closed, altrimenti riapre.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """True se si può tentare una chiamata verso OS1."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._probing and time.time() - self.opened_at >= self.cooldown:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            was_open = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+        if was_open:
+            logger.info("OS1 di nuovo raggiungibile: circuit breaker chiuso")
+        return was_open
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"OS1 non raggiungibile: circuit breaker aperto per {self.cooldown}s")
+                self.opened_at = time.time()
+
+
+class RequestLog:
+    """Registro delle chiamate GET fatte durante una domanda (vedi OS1Client.track_requests)."""
+
+    def __init__(self):
+        self.requests = []  # [(endpoint, params)] andate a buon fine
+        self.stale = False  # almeno un dato servito dalla cache perché OS1 non rispondeva
+        self.failed = False  # almeno una chiamata fallita
+        self.kpi_clienti = []  # clienti di cui è stato letto lo snapshot KPI (kpi_clienti.py)
+
+
+def _is_outage(error):
+    """Errori che indicano OS1/VPN giù o lento (non errori applicativi 4xx)."""
+    if isinstance(error, (ConnectionError, requests.exceptions.ConnectionError,
+                          requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = getattr(error, "response", None)
+        return response is not None and response.status_code >= 500
+    return False
+
 
 class OS1Client:
-    def __init__(self, server="192.168.0.224", port=8090):
+    def __init__(self, server="192.168.0.224", port=8090, cache_path=CACHE_PATH, cache_ttl=CACHE_TTL):
         self.base_url = f"http://{server}:{port}/rest/idea"
         self.token = None
         self.token_time = None
+        # Cache in memoria (LRU) + livello opzionale su disco che sopravvive ai riavvii
+        self.cache_ttl = cache_ttl
+        self.stale_ttl = max(CACHE_STALE_TTL, cache_ttl)
+        self._cache = OrderedDict()  # chiave -> (dati, salvato_il)
+        self._cache_lock = threading.Lock()
+        # Modalità degradata: breaker, dati serviti dalla cache e chiavi da riaggiornare
+        self.breaker = CircuitBreaker()
+        self._local = threading.local()
+        self._pending_refresh = {}  # chiave -> (endpoint, params)
+        self._refreshing = False
+        self._fingerprints = {}  # chiave -> (salvato_il, hash dei dati)
+        self.disk_cache = None
+        if cache_path:
+            try:
+                self.disk_cache = DiskCache(
+                    cache_path, ttl=cache_ttl, max_bytes=CACHE_MAX_MB * 1024 * 1024,
+                    stale_ttl=self.stale_ttl
+                )
+                self._warm_cache()
+            except Exception as e:
+                logger.warning(f"Cache su disco non disponibile ({cache_path}): {e}")
+                self.disk_cache = None
         # Credenziali hard-coded per evitare problemi con carattere ? in password
         self.credentials = {
             "username": "PartnerD",
@@ -46,10 +164,7 @@ class OS1Client:
 
         except requests.exceptions.ConnectionError:
             logger.error("Impossibile connettersi a OS1. Verifica che la VPN sia attiva.")
-            raise ConnectionError(
-                "Connessione a OS1 fallita. Assicurati che la VPN OpenVPN sia attiva "
-                "e che il server 192.168.0.224 sia raggiungibile."
-            )
+            raise ConnectionError(OS1_NON_RAGGIUNGIBILE)
         except Exception as e:
             logger.error(f"Errore autenticazione: {e}")
             raise
@@ -61,12 +176,218 @@ class OS1Client:
             self.authenticate()
         return {"Authorization": f"Bearer {self.token}"}
 
+    # ──────────────────────────────────────────────
+    # CACHE RISPOSTE (memoria + disco)
+    # ──────────────────────────────────────────────
+
+    def _warm_cache(self):
+        """All'avvio carica in memoria le risposte recenti dal disco, senza toccare la rete."""
+        entries = self.disk_cache.recent(limit=MEMORY_CACHE_MAX_ENTRIES)
+        with self._cache_lock:
+            # recent() restituisce dal più usato: inseriamo al contrario per mantenere l'ordine LRU
+            for key, data, stored_at in reversed(entries):
+                self._cache[key] = (data, stored_at)
+        if entries:
+            logger.info(f"Cache OS1 scaldata dal disco: {len(entries)} risposte")
+
+    def _cache_get(self, key, max_age=None):
+        """Cerca prima in memoria, poi su disco. Restituisce (dati, salvato_il) o None.
+        max_age (default: cache_ttl) permette di accettare anche dati scaduti."""
+        max_age = self.cache_ttl if max_age is None else max_age
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry and time.time() - entry[1] <= max_age:
+                self._cache.move_to_end(key)
+                return entry
+
+        if self.disk_cache:
+            hit = self.disk_cache.get(key, max_age=max_age)
+            if hit:
+                self._cache_put(key, hit[0], hit[1], persist=False)
+                return hit
+        return None
+
+    def _cache_put(self, key, data, stored_at=None, persist=True):
+        stored_at = stored_at or time.time()
+        with self._cache_lock:
+            self._cache[key] = (data, stored_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > MEMORY_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+        if persist and self.disk_cache:
+            self.disk_cache.set(key, data, stored_at)
+
+    def clear_cache(self):
+        """Svuota la cache in memoria e su disco."""
+        with self._cache_lock:
+            self._cache.clear()
+            self._fingerprints.clear()
+        if self.disk_cache:
+            self.disk_cache.clear()
+
+    # ──────────────────────────────────────────────
+    # MODALITÀ DEGRADATA (OS1 / VPN non raggiungibili)
+    # ──────────────────────────────────────────────
+
+    def pop_stale_timestamp(self):
+        """
+        Timestamp (epoch) del dato più vecchio servito dalla cache perché OS1 non
+        rispondeva, dall'ultima chiamata a questo metodo nel thread corrente. None se
+        tutti i dati erano aggiornati.
+        """
+        stale = getattr(self._local, "stale_at", None)
+        self._local.stale_at = None
+        return stale
+
+    # ──────────────────────────────────────────────
+    # TRACCIAMENTO DIPENDENZE (usato dalla cache delle risposte)
+    # ──────────────────────────────────────────────
+
+    @contextmanager
+    def track_requests(self):
+        """Registra le chiamate GET fatte nel thread corrente dentro il blocco with."""
+        log = RequestLog()
+        previous = getattr(self._local, "request_log", None)
+        self._local.request_log = log
+        try:
+            yield log
+        finally:
+            self._local.request_log = previous
+
+    def current_request_log(self):
+        """RequestLog attivo nel thread corrente (dentro track_requests), o None."""
+        return getattr(self._local, "request_log", None)
+
+    def fingerprint(self, endpoint, params=None):
+        """
+        Hash dei dati attuali per endpoint+params (dalla cache se freschi, altrimenti da OS1).
+        None se OS1 non risponde e il dato disponibile è solo quello vecchio.
+        """
+        if params:
+            params = {k: v for k, v in params.items() if v is not None}
+        key = make_cache_key(endpoint, params)
+        with self.track_requests() as log:
+            try:
+                data = self._get(endpoint, params)
+            except ConnectionError:
+                return None
+        if log.stale:
+            return None
+
+        entry = self._cache_get(key)
+        stored_at = entry[1] if entry else None
+        with self._cache_lock:
+            memo = self._fingerprints.get(key)
+        if memo and stored_at is not None and memo[0] == stored_at:
+            return memo[1]
+
+        digest = hashlib.sha1(
+            json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+        if stored_at is not None:
+            with self._cache_lock:
+                self._fingerprints[key] = (stored_at, digest)
+        return digest
+
+    def _serve_stale(self, key, endpoint, params, error=None):
+        """Restituisce l'ultimo dato noto per key, o rilancia l'errore di connessione."""
+        entry = self._cache_get(key, max_age=self.stale_ttl)
+        if entry is None:
+            if error is not None and not isinstance(error, ConnectionError):
+                raise ConnectionError(OS1_NON_RAGGIUNGIBILE) from error
+            raise error or ConnectionError(OS1_NON_RAGGIUNGIBILE)
+
+        data, stored_at = entry
+        log = getattr(self._local, "request_log", None)
+        if log is not None:
+            log.stale = True
+            log.requests.append((endpoint, params))
+        previous = getattr(self._local, "stale_at", None)
+        self._local.stale_at = stored_at if previous is None else min(previous, stored_at)
+        with self._cache_lock:
+            self._pending_refresh[key] = (endpoint, params)
+        logger.warning(f"OS1 non raggiungibile: servo {key} dalla cache")
+        return data
+
+    def _refresh_pending_async(self):
+        """Quando OS1 torna raggiungibile riaggiorna in background i dati serviti scaduti."""
+        with self._cache_lock:
+            if self._refreshing or not self._pending_refresh:
+                return
+            pending = list(self._pending_refresh.items())
+            self._pending_refresh = {}
+            self._refreshing = True
+
+        def worker():
+            fatti = 0
+            try:
+                for key, (endpoint, params) in pending:
+                    if not self.breaker.allow():
+                        break
+                    try:
+                        data = self._fetch(endpoint, params)
+                        self.breaker.record_success()
+                        if data is not None:
+                            self._cache_put(key, data)
+                    except Exception as e:
+                        if _is_outage(e):
+                            self.breaker.record_failure()
+                            break
+                        logger.warning(f"Refresh in background di {key} fallito: {e}")
+                    fatti += 1
+            finally:
+                with self._cache_lock:
+                    # Chiavi non riaggiornate (OS1 di nuovo giù): al prossimo giro
+                    for key, value in pending[fatti:]:
+                        self._pending_refresh.setdefault(key, value)
+                    self._refreshing = False
+
+        threading.Thread(target=worker, name="os1-refresh", daemon=True).start()
+
     def _get(self, endpoint, params=None):
-        """Chiamata GET generica con gestione errori."""
+        """
+        Chiamata GET con cache: memoria → disco → OS1.
+        Se OS1 non risponde (o il breaker è aperto) serve l'ultimo dato noto.
+        """
         # Rimuovi parametri None
         if params:
             params = {k: v for k, v in params.items() if v is not None}
 
+        key = make_cache_key(endpoint, params)
+        log = getattr(self._local, "request_log", None)
+        cached = self._cache_get(key)
+        if cached is not None:
+            if log is not None:
+                log.requests.append((endpoint, params))
+            return cached[0]
+
+        try:
+            if not self.breaker.allow():
+                return self._serve_stale(key, endpoint, params)
+
+            try:
+                data = self._fetch(endpoint, params)
+            except Exception as e:
+                if not _is_outage(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                return self._serve_stale(key, endpoint, params, error=e)
+        except Exception:
+            if log is not None:
+                log.failed = True
+            raise
+
+        if log is not None:
+            log.requests.append((endpoint, params))
+        self.breaker.record_success()
+        if data is not None:
+            self._cache_put(key, data)
+        self._refresh_pending_async()
+        return data
+
+    def _fetch(self, endpoint, params=None):
+        """Chiamata GET generica verso OS1 con gestione errori."""
         try:
             response = requests.get(
                 f"{self.base_url}{endpoint}",
@@ -214,20 +535,36 @@ class OS1Client:
     # ──────────────────────────────────────────────
 
     def test_connection(self):
-        """Verifica che VPN e autenticazione funzionino."""
+        """Verifica che VPN e autenticazione funzionino (passando dal circuit breaker)."""
+        if not self.breaker.allow():
+            trascorsi = time.time() - (self.breaker.opened_at or 0)
+            attesa = max(0, int(self.breaker.cooldown - trascorsi))
+            return {
+                "status": "error",
+                "message": f"{OS1_NON_RAGGIUNGIBILE} Nuovo tentativo possibile tra {attesa}s."
+            }
         try:
             success = self.authenticate()
             if success:
-                # Prova una chiamata reale
-                clienti = self._get("/erp/cliente")
+                # Prova una chiamata reale (senza passare dalla cache)
+                clienti = self._fetch("/erp/cliente")
+                if clienti is not None:
+                    self._cache_put(make_cache_key("/erp/cliente"), clienti)
+                self.breaker.record_success()
+                self._refresh_pending_async()
                 n = len(clienti) if isinstance(clienti, list) else 0
                 return {
                     "status": "ok",
                     "message": f"Connessione OK. {n} clienti trovati nel database.",
                     "token_preview": self.token[:20] + "..." if self.token else None
                 }
+            self.breaker.record_success()  # OS1 ha risposto, sono le credenziali
             return {"status": "error", "message": "Autenticazione fallita (IsVerified: false)"}
-        except ConnectionError as e:
-            return {"status": "error", "message": str(e)}
         except Exception as e:
+            if _is_outage(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            if isinstance(e, ConnectionError):
+                return {"status": "error", "message": str(e)}
             return {"status": "error", "message": f"Errore: {str(e)}"}
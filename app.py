@@ -4,14 +4,14 @@ Chatbot conversazionale per interrogare il gestionale OS1 in linguaggio naturale
 
 Uso: streamlit run app.py
 Requisiti: VPN attiva, API key Anthropic configurata
+
+Streamlit riesegue questo file ad ogni interazione: qui resta solo l'interfaccia.
+Prompt, tools e client vivono in moduli importati (eseguiti una volta per processo)
+e le dipendenze pesanti (anthropic, requests) si caricano solo quando servono.
 """
 
-import streamlit as st
-import anthropic
-import json
 import os
-from datetime import datetime
-from api_os1 import OS1Client
+import streamlit as st
 
 # ──────────────────────────────────────────────
 # CONFIGURAZIONE
@@ -20,355 +20,37 @@ from api_os1 import OS1Client
 # Inserisci la tua API key Anthropic qui o in variabile d'ambiente
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "sk-ant-REDACTED")
 
-SYSTEM_PROMPT = """Sei l'assistente AI di Partner Data, un'azienda italiana che vende soluzioni 
-di identificazione automatica (smart card, lettori, stampanti card, tecnologia RFID, controllo accessi).
-
-Il tuo ruolo è aiutare i commerciali a trovare rapidamente informazioni su clienti, ordini, offerte, 
-fatture e vendite dal gestionale OS1.
-
-COME COMPORTARTI:
-- Rispondi SEMPRE in italiano
-- Sii conciso e professionale, vai dritto al punto
-- Quando l'utente menziona un cliente, prima cercalo per nome o codice
-- Per domande su fatturato, recupera le fatture e calcola i totali
-- Formatta gli importi in euro (€) con separatore migliaia (es: €127.350,00)
-- Formatta le date in formato italiano (gg/mm/aaaa)
-- Se i dati non bastano per rispondere, chiedi chiarimenti
-- Se un tool non restituisce risultati, dillo chiaramente
-- Se un tool restituisce un errore di connessione o autenticazione, NON inventare dati: spiega solo che il gestionale non è raggiungibile
-- Puoi fare più chiamate API in sequenza se necessario (es: prima cerca cliente, poi prendi le fatture)
-
-STATI DEI DOCUMENTI:
-- Offerte e ordini hanno 3 stati possibili: "inevaso", "evaso totalmente", "evaso parzialmente"
-- "Offerte aperte" = offerte con stato "inevaso"
-- "Offerte chiuse" = offerte con stato "evaso totalmente"
-
-CATEGORIE PRODOTTO (da arricchire con file Excel di Francesco):
-- Gruppi vendita (macro): reparto card, reparto animali, reparto smart card, hardware, lettori
-- Categorie merceologiche (dettaglio): tessera combo, tessera contatto, tessera RFID, ecc.
-
-Oggi è il {today}.
-""".format(today=datetime.now().strftime("%d/%m/%Y"))
-
 # ──────────────────────────────────────────────
-# DEFINIZIONE TOOLS PER CLAUDE
+# RISORSE CONDIVISE (create una volta, riusate tra i rerun)
 # ──────────────────────────────────────────────
 
-TOOLS = [
-    {
-        "name": "cerca_cliente",
-        "description": (
-            "Cerca un cliente nel database OS1 per nome, ragione sociale o codice numerico. "
-            "Usa questo tool quando l'utente menziona un cliente specifico e vuoi trovare "
-            "il suo codice o le sue informazioni anagrafiche. Restituisce una lista di clienti trovati."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "Nome, ragione sociale o codice numerico del cliente da cercare"
-                }
-            },
-            "required": ["query"]
-        }
-    },
-    {
-        "name": "get_dettaglio_cliente",
-        "description": (
-            "Recupera i dettagli anagrafici completi di un cliente dato il suo codice numerico. "
-            "Usa questo quando hai già il codice cliente e vuoi i dati completi (indirizzo, contatti, ecc.)."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "id_cliente": {
-                    "type": "string",
-                    "description": "Codice numerico del cliente (es: '444')"
-                }
-            },
-            "required": ["id_cliente"]
-        }
-    },
-    {
-        "name": "get_offerte_cliente",
-        "description": (
-            "Recupera le offerte/preventivi di un cliente dal gestionale OS1. "
-            "Usa questo quando l'utente chiede: offerte aperte, preventivi, prezzi offerti, "
-            "offerte da sollecitare, stato delle offerte. "
-            "Puoi filtrare per periodo con data_da e data_a."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "id_cliente": {
-                    "type": "string",
-                    "description": "Codice numerico del cliente"
-                },
-                "data_da": {
-                    "type": "string",
-                    "description": "Data inizio periodo, formato YYYY-MM-DD (opzionale)"
-                },
-                "data_a": {
-                    "type": "string",
-                    "description": "Data fine periodo, formato YYYY-MM-DD (opzionale)"
-                }
-            },
-            "required": ["id_cliente"]
-        }
-    },
-    {
-        "name": "get_ordini_cliente",
-        "description": (
-            "Recupera gli ordini di un cliente dal gestionale OS1. "
-            "Usa questo quando l'utente chiede: ordini, stato ordini, date consegna, "
-            "ordini evasi o inevasi, storico ordini. "
-            "Puoi filtrare per periodo e per agente commerciale."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "id_cliente": {
-                    "type": "string",
-                    "description": "Codice numerico del cliente"
-                },
-                "data_da": {
-                    "type": "string",
-                    "description": "Data inizio periodo, formato YYYY-MM-DD (opzionale)"
-                },
-                "data_a": {
-                    "type": "string",
-                    "description": "Data fine periodo, formato YYYY-MM-DD (opzionale)"
-                },
-                "id_agente": {
-                    "type": "string",
-                    "description": "Codice agente commerciale (opzionale)"
-                }
-            },
-            "required": ["id_cliente"]
-        }
-    },
-    {
-        "name": "get_fatture_cliente",
-        "description": (
-            "Recupera le fatture e note di credito di un cliente dal gestionale OS1. "
-            "Usa questo quando l'utente chiede: fatturato, fatture, importi, "
-            "analisi economica, quanto ha speso un cliente, volume d'affari. "
-            "Per calcolare il fatturato totale, somma gli importi delle fatture nel periodo."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "id_cliente": {
-                    "type": "string",
-                    "description": "Codice numerico del cliente"
-                },
-                "data_da": {
-                    "type": "string",
-                    "description": "Data inizio periodo, formato YYYY-MM-DD (opzionale)"
-                },
-                "data_a": {
-                    "type": "string",
-                    "description": "Data fine periodo, formato YYYY-MM-DD (opzionale)"
-                }
-            },
-            "required": ["id_cliente"]
-        }
-    },
-    {
-        "name": "get_bolle_cliente",
-        "description": (
-            "Recupera i DDT (documenti di trasporto / bolle) di un cliente. "
-            "Usa questo quando l'utente chiede: consegne, spedizioni, date di consegna, DDT."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "id_cliente": {
-                    "type": "string",
-                    "description": "Codice numerico del cliente"
-                },
-                "data_da": {
-                    "type": "string",
-                    "description": "Data inizio periodo, formato YYYY-MM-DD (opzionale)"
-                },
-                "data_a": {
-                    "type": "string",
-                    "description": "Data fine periodo, formato YYYY-MM-DD (opzionale)"
-                }
-            },
-            "required": ["id_cliente"]
-        }
-    },
-    {
-        "name": "lista_clienti",
-        "description": (
-            "Recupera la lista di tutti i clienti nel database. "
-            "Usa solo se l'utente chiede esplicitamente di vedere tutti i clienti o una lista generale."
-        ),
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "limit": {
-                    "type": "integer",
-                    "description": "Numero massimo di clienti da restituire (default: 20)",
-                    "default": 20
-                }
-            },
-            "required": []
-        }
-    }
-]
+@st.cache_resource
+def get_os1_client():
+    """Client OS1 condiviso tra i rerun: la cache in memoria sopravvive tra le domande.
+    Se OS1_CACHE_PATH è impostato, all'avvio si scalda dalla cache su disco."""
+    from api_os1 import OS1Client
+    return OS1Client()
 
-# ──────────────────────────────────────────────
-# ESECUZIONE TOOLS
-# ──────────────────────────────────────────────
 
-def execute_tool(os1_client, tool_name, tool_input):
-    """Esegue il tool richiesto da Claude e restituisce il risultato."""
-    try:
-        if tool_name == "cerca_cliente":
-            result = os1_client.cerca_cliente(tool_input["query"])
-        elif tool_name == "get_dettaglio_cliente":
-            result = os1_client.get_cliente(tool_input["id_cliente"])
-        elif tool_name == "get_offerte_cliente":
-            result = os1_client.get_offerte_cliente(
-                id_cliente=tool_input["id_cliente"],
-                data_da=tool_input.get("data_da"),
-                data_a=tool_input.get("data_a")
-            )
-        elif tool_name == "get_ordini_cliente":
-            result = os1_client.get_ordini_cliente(
-                id_cliente=tool_input["id_cliente"],
-                data_da=tool_input.get("data_da"),
-                data_a=tool_input.get("data_a"),
-                id_agente=tool_input.get("id_agente")
-            )
-        elif tool_name == "get_fatture_cliente":
-            result = os1_client.get_fatture_cliente(
-                id_cliente=tool_input["id_cliente"],
-                data_da=tool_input.get("data_da"),
-                data_a=tool_input.get("data_a")
-            )
-        elif tool_name == "get_bolle_cliente":
-            result = os1_client.get_bolle_cliente(
-                id_cliente=tool_input["id_cliente"],
-                data_da=tool_input.get("data_da"),
-                data_a=tool_input.get("data_a")
-            )
-        elif tool_name == "lista_clienti":
-            result = os1_client.lista_clienti(
-                limit=tool_input.get("limit", 20)
-            )
-        else:
-            result = {"error": f"Tool sconosciuto: {tool_name}"}
+def use_os1_client():
+    """get_os1_client() per le azioni che parlano con OS1: segna la sessione così la
+    sidebar legge lo stato del breaker solo quando il client esiste già."""
+    st.session_state.os1_in_uso = True
+    return get_os1_client()
 
-        # Tronca risultati troppo grandi per non superare il contesto di Claude
-        result_json = json.dumps(result, ensure_ascii=False, default=str)
-        if len(result_json) > 50000:
-            if isinstance(result, list):
-                result = result[:30]  # Limita a 30 record
-                result.append({"_nota": f"Risultati troncati. Totale originale: {len(result)} record."})
-            result_json = json.dumps(result, ensure_ascii=False, default=str)
 
-        return result_json
+@st.cache_resource
+def get_answer_cache():
+    """Cache delle risposte condivisa tra sessioni (domande simili sugli stessi dati)."""
+    from answer_cache import AnswerCache
+    return AnswerCache()
 
-    except ConnectionError as e:
-        return json.dumps({"error": str(e)})
-    except Exception as e:
-        return json.dumps({"error": f"Errore durante {tool_name}: {str(e)}"})
 
-
-def normalize_assistant_text(text):
-    """Normalizza eventuali newline escaped (\\n) prodotti dal modello."""
-    if not isinstance(text, str):
-        return ""
-
-    normalized = text.strip()
-    # Converte solo in presenza di sequenze escaped, evitando doppie trasformazioni.
-    if "\\n" in normalized:
-        normalized = normalized.replace("\\n", "\n")
-    return normalized
-
-
-# ──────────────────────────────────────────────
-# CHAT CON CLAUDE + FUNCTION CALLING LOOP
-# ──────────────────────────────────────────────
-
-def chat_with_claude(client, os1_client, messages):
-    """
-    Invia messaggi a Claude con tools. Gestisce il loop di function calling:
-    Claude può fare più chiamate API prima di dare la risposta finale.
-    """
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,
-        system=SYSTEM_PROMPT,
-        tools=TOOLS,
-        messages=messages
-    )
-
-    # Loop: Claude potrebbe voler fare più chiamate API
-    max_iterations = 10  # Sicurezza anti-loop infinito
-    iteration = 0
-
-    while response.stop_reason == "tool_use" and iteration < max_iterations:
-        iteration += 1
-
-        # Aggiungi la risposta di Claude (con tool_use) alla conversazione
-        messages.append({"role": "assistant", "content": response.content})
-
-        # Esegui TUTTI i tool richiesti (Claude può chiederne più di uno)
-        tool_results = []
-        for block in response.content:
-            if block.type == "tool_use":
-                result = execute_tool(os1_client, block.name, block.input)
-
-                # Se il gestionale non è raggiungibile, evita passaggi inutili al modello
-                try:
-                    parsed = json.loads(result)
-                    if isinstance(parsed, dict) and parsed.get("error"):
-                        error_text = parsed["error"].lower()
-                        if "connessione" in error_text or "vpn" in error_text:
-                            return (
-                                "Al momento non riesco a connettermi al gestionale OS1. "
-                                "Verifica che la VPN OpenVPN sia attiva e che il server OS1 sia raggiungibile, "
-                                "poi riprova la richiesta."
-                            )
-                except (TypeError, json.JSONDecodeError):
-                    pass
-
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": block.id,
-                    "content": result
-                })
-
-        # Rimanda i risultati a Claude
-        messages.append({"role": "user", "content": tool_results})
-
-        # Claude elabora i risultati e decide: risponde o fa altre chiamate
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=SYSTEM_PROMPT,
-            tools=TOOLS,
-            messages=messages
-        )
-
-    # Estrai la risposta testuale finale
-    text_parts = []
-    for block in response.content:
-        if hasattr(block, "text"):
-            text_parts.append(block.text)
-
-    final_text = "\n".join(text_parts) if text_parts else "Non sono riuscito a elaborare una risposta."
-    final_text = normalize_assistant_text(final_text)
-
-    # Aggiungi risposta finale alla conversazione
-    messages.append({"role": "assistant", "content": response.content})
-
-    return final_text
+@st.cache_resource
+def get_anthropic_client(api_key):
+    """Client Anthropic per API key (connessioni HTTP riusate tra le domande)."""
+    import anthropic
+    return anthropic.Anthropic(api_key=api_key)
 
 
 # ──────────────────────────────────────────────
@@ -399,11 +81,14 @@ def main():
         st.divider()
         st.header("📡 Stato Connessione")
 
+        # Niente import di api_os1/requests solo per disegnare la sidebar
+        if st.session_state.get("os1_in_uso") and get_os1_client().breaker.is_open:
+            st.warning("⚠️ OS1 non raggiungibile: risposte dagli ultimi dati salvati")
+
         # Test connessione OS1
         if st.button("🔌 Testa connessione OS1"):
             with st.spinner("Connessione in corso..."):
-                os1 = OS1Client()
-                result = os1.test_connection()
+                result = use_os1_client().test_connection()
                 if result["status"] == "ok":
                     st.success(result["message"])
                 else:
@@ -426,6 +111,13 @@ def main():
             st.session_state.api_messages = []
             st.rerun()
 
+        stats = get_answer_cache().stats()
+        if stats["hits"] + stats["misses"]:
+            st.caption(
+                f"⚡ Cache risposte: {stats['hits']} su {stats['hits'] + stats['misses']} "
+                f"domande ({stats['hit_rate']:.0%})"
+            )
+
     # ── Inizializzazione stato sessione ──
     if "messages" not in st.session_state:
         st.session_state.messages = []  # Per visualizzazione UI
@@ -436,6 +128,8 @@ def main():
     for msg in st.session_state.messages:
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
+            if msg.get("from_cache"):
+                st.caption("⚡ Risposta dalla cache")
 
     # ── Input utente ──
     if prompt := st.chat_input("Scrivi la tua domanda sui dati Partner Data..."):
@@ -452,9 +146,12 @@ def main():
         # Chiama Claude
         with st.chat_message("assistant"):
             with st.spinner("Sto cercando i dati..."):
+                import anthropic
+                from assistente import chat_with_claude
+
                 try:
-                    client = anthropic.Anthropic(api_key=api_key)
-                    os1_client = OS1Client()
+                    client = get_anthropic_client(api_key)
+                    os1_client = use_os1_client()
 
                     # Aggiungi messaggio utente alla conversazione API
                     st.session_state.api_messages.append({
@@ -462,17 +159,33 @@ def main():
                         "content": prompt
                     })
 
-                    # Chat con function calling loop
-                    response_text = chat_with_claude(
-                        client,
-                        os1_client,
-                        st.session_state.api_messages
-                    )
+                    # Domanda già posta sugli stessi dati: risposta immediata dalla cache
+                    answer_cache = get_answer_cache()
+                    response_text = answer_cache.lookup(prompt, os1_client)
+                    from_cache = response_text is not None
+
+                    if from_cache:
+                        st.session_state.api_messages.append({
+                            "role": "assistant",
+                            "content": response_text
+                        })
+                    else:
+                        # Chat con function calling loop
+                        with os1_client.track_requests() as request_log:
+                            response_text = chat_with_claude(
+                                client,
+                                os1_client,
+                                st.session_state.api_messages
+                            )
+                        answer_cache.store(prompt, response_text, os1_client, request_log)
 
                     st.markdown(response_text)
+                    if from_cache:
+                        st.caption("⚡ Risposta dalla cache")
                     st.session_state.messages.append({
                         "role": "assistant",
-                        "content": response_text
+                        "content": response_text,
+                        "from_cache": from_cache
                     })
 
                 except anthropic.AuthenticationError:
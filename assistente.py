@@ -0,0 +1,149 @@
+"""
+Logica conversazionale - Partner Data
+System prompt e loop di function calling con Claude, separati dall'interfaccia Streamlit
+così non vengono ricostruiti ad ogni rerun di app.py.
+"""
+
+import json
+from datetime import date
+from functools import lru_cache
+
+from tools_os1 import TOOLS, execute_tool
+
+MODEL = "claude-sonnet-4-20250514"
+
+SYSTEM_PROMPT_TEMPLATE = """Sei l'assistente AI di Partner Data, un'azienda italiana che vende soluzioni 
+di identificazione automatica (smart card, lettori, stampanti card, tecnologia RFID, controllo accessi).
+
+Il tuo ruolo è aiutare i commerciali a trovare rapidamente informazioni su clienti, ordini, offerte, 
+fatture e vendite dal gestionale OS1.
+
+COME COMPORTARTI:
+- Rispondi SEMPRE in italiano
+- Sii conciso e professionale, vai dritto al punto
+- Quando l'utente menziona un cliente, prima cercalo per nome o codice
+- Per fatturato annuale/mensile, offerte aperte o da sollecitare, ordini inevasi e ultima consegna usa PRIMA get_kpi_cliente (KPI già calcolati); usa le fatture/offerte/ordini di dettaglio solo se servono i singoli documenti o un periodo specifico
+- Negli ordini inevasi di get_kpi_cliente, "totale_da_evadere" è il valore ancora da evadere; "evasi_parzialmente_senza_residuo" è il valore intero di ordini già in parte evasi: NON presentarlo come residuo, dillo separatamente
+- Se get_kpi_cliente restituisce un errore, una sezione a null o "documenti_non_interpretati", NON rispondere con zeri: usa i tool di dettaglio per quei documenti
+- Per domande su fatturato non coperte dai KPI, recupera le fatture e calcola i totali
+- Formatta gli importi in euro (€) con separatore migliaia (es: €127.350,00)
+- Formatta le date in formato italiano (gg/mm/aaaa)
+- Se i dati non bastano per rispondere, chiedi chiarimenti
+- Se un tool non restituisce risultati, dillo chiaramente
+- Se un tool restituisce un errore di connessione o autenticazione, NON inventare dati: spiega solo che il gestionale non è raggiungibile
+- Se un risultato contiene "dati_aggiornati_al", il gestionale non è raggiungibile e i dati vengono dall'ultima lettura salvata: rispondi comunque, ma indica chiaramente all'inizio "Dati aggiornati al <data e ora>"
+- Puoi fare più chiamate API in sequenza se necessario (es: prima cerca cliente, poi prendi le fatture)
+
+STATI DEI DOCUMENTI:
+- Offerte e ordini hanno 3 stati possibili: "inevaso", "evaso totalmente", "evaso parzialmente"
+- "Offerte aperte" = offerte con stato "inevaso"
+- "Offerte chiuse" = offerte con stato "evaso totalmente"
+
+CATEGORIE PRODOTTO (da arricchire con file Excel di Francesco):
+- Gruppi vendita (macro): reparto card, reparto animali, reparto smart card, hardware, lettori
+- Categorie merceologiche (dettaglio): tessera combo, tessera contatto, tessera RFID, ecc.
+
+Oggi è il {today}.
+"""
+
+
+@lru_cache(maxsize=1)
+def _system_prompt_for(today):
+    return SYSTEM_PROMPT_TEMPLATE.format(today=today.strftime("%d/%m/%Y"))
+
+
+def get_system_prompt():
+    """System prompt con la data di oggi, ricostruito solo quando cambia giorno."""
+    return _system_prompt_for(date.today())
+
+
+def normalize_assistant_text(text):
+    """Normalizza eventuali newline escaped (\\n) prodotti dal modello."""
+    if not isinstance(text, str):
+        return ""
+
+    normalized = text.strip()
+    # Converte solo in presenza di sequenze escaped, evitando doppie trasformazioni.
+    if "\\n" in normalized:
+        normalized = normalized.replace("\\n", "\n")
+    return normalized
+
+
+# ──────────────────────────────────────────────
+# CHAT CON CLAUDE + FUNCTION CALLING LOOP
+# ──────────────────────────────────────────────
+
+def chat_with_claude(client, os1_client, messages):
+    """
+    Invia messaggi a Claude con tools. Gestisce il loop di function calling:
+    Claude può fare più chiamate API prima di dare la risposta finale.
+    """
+    response = client.messages.create(
+        model=MODEL,
+        max_tokens=4096,
+        system=get_system_prompt(),
+        tools=TOOLS,
+        messages=messages
+    )
+
+    # Loop: Claude potrebbe voler fare più chiamate API
+    max_iterations = 10  # Sicurezza anti-loop infinito
+    iteration = 0
+
+    while response.stop_reason == "tool_use" and iteration < max_iterations:
+        iteration += 1
+
+        # Aggiungi la risposta di Claude (con tool_use) alla conversazione
+        messages.append({"role": "assistant", "content": response.content})
+
+        # Esegui TUTTI i tool richiesti (Claude può chiederne più di uno)
+        tool_results = []
+        for block in response.content:
+            if block.type == "tool_use":
+                result = execute_tool(os1_client, block.name, block.input)
+
+                # Se il gestionale non è raggiungibile, evita passaggi inutili al modello
+                try:
+                    parsed = json.loads(result)
+                    if isinstance(parsed, dict) and parsed.get("error"):
+                        error_text = parsed["error"].lower()
+                        if "connessione" in error_text or "vpn" in error_text:
+                            return (
+                                "Al momento non riesco a connettermi al gestionale OS1. "
+                                "Verifica che la VPN OpenVPN sia attiva e che il server OS1 sia raggiungibile, "
+                                "poi riprova la richiesta."
+                            )
+                except (TypeError, json.JSONDecodeError):
+                    pass
+
+                tool_results.append({
+                    "type": "tool_result",
+                    "tool_use_id": block.id,
+                    "content": result
+                })
+
+        # Rimanda i risultati a Claude
+        messages.append({"role": "user", "content": tool_results})
+
+        # Claude elabora i risultati e decide: risponde o fa altre chiamate
+        response = client.messages.create(
+            model=MODEL,
+            max_tokens=4096,
+            system=get_system_prompt(),
+            tools=TOOLS,
+            messages=messages
+        )
+
+    # Estrai la risposta testuale finale
+    text_parts = []
+    for block in response.content:
+        if hasattr(block, "text"):
+            text_parts.append(block.text)
+
+    final_text = "\n".join(text_parts) if text_parts else "Non sono riuscito a elaborare una risposta."
+    final_text = normalize_assistant_text(final_text)
+
+    # Aggiungi risposta finale alla conversazione
+    messages.append({"role": "assistant", "content": response.content})
+
+    return final_text
@@ -0,0 +1,110 @@
+"""
+Benchmark avvio app - Partner Data
+Misura, in un processo nuovo, il cold start (primo run dello script Streamlit, come al primo
+accesso dopo un riavvio) e i rerun successivi, e fallisce se superano le soglie o se il primo
+render importa moduli pesanti (regressione).
+
+Uso: python bench_avvio.py [--runs 5] [--max-cold 2.0] [--max-rerun 0.5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Moduli che il primo render (senza domande) non deve importare
+HEAVY_MODULES = ("anthropic", "requests", "api_os1", "assistente", "kpi_clienti")
+
+# Eseguito in un processo nuovo: import di streamlit, primo run dello script e rerun.
+# I moduli pesanti sono quelli comparsi in sys.modules durante il primo run di app.py.
+RUN_SNIPPET = """
+import json, sys, time
+t = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+import_streamlit = time.perf_counter() - t
+
+before = set(sys.modules)
+at = AppTest.from_file({app!r}, default_timeout=60)
+t = time.perf_counter()
+at.run()
+primo_run = time.perf_counter() - t
+nuovi = set(sys.modules) - before
+
+reruns = []
+for _ in range({reruns}):
+    t = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - t)
+
+print(json.dumps({{
+    "import_streamlit": import_streamlit,
+    "primo_run": primo_run,
+    "reruns": reruns,
+    "eager_imports": [m for m in {heavy!r} if m in nuovi],
+    "errori": [str(e.value) for e in at.exception],
+}}))
+"""
+
+
+def misura(runs):
+    """Mediane su `runs` processi nuovi: import streamlit, primo run e rerun di app.py."""
+    import_st, primi, reruns, eager, errori = [], [], [], set(), set()
+    snippet = RUN_SNIPPET.format(
+        app=os.path.join(APP_DIR, "app.py"), reruns=runs, heavy=HEAVY_MODULES
+    )
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        data = json.loads(out)
+        import_st.append(data["import_streamlit"])
+        primi.append(data["primo_run"])
+        reruns.extend(data["reruns"])
+        eager.update(data["eager_imports"])
+        errori.update(data["errori"])
+    return {
+        "import_streamlit": statistics.median(import_st),
+        "primo_run": statistics.median(primi),
+        "rerun": statistics.median(reruns),
+        "eager_imports": sorted(eager),
+        "errori": sorted(errori),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold start e rerun di app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-cold", type=float, default=2.0, help="Soglia primo run (s)")
+    parser.add_argument("--max-rerun", type=float, default=0.5, help="Soglia rerun (s)")
+    args = parser.parse_args()
+
+    r = misura(args.runs)
+
+    print(f"Import streamlit (comune):   {r['import_streamlit'] * 1000:.0f} ms")
+    print(f"Cold start (primo run app):  {r['primo_run'] * 1000:.0f} ms")
+    print(f"Rerun (mediana):             {r['rerun'] * 1000:.0f} ms")
+    print(f"Import pesanti al 1° render: {', '.join(r['eager_imports']) or 'nessuno'}")
+
+    problemi = []
+    if r["errori"]:
+        problemi.append(f"eccezioni nello script: {'; '.join(r['errori'])}")
+    if r["primo_run"] > args.max_cold:
+        problemi.append(f"cold start {r['primo_run']:.2f}s > {args.max_cold}s")
+    if r["rerun"] > args.max_rerun:
+        problemi.append(f"rerun {r['rerun']:.2f}s > {args.max_rerun}s")
+    if r["eager_imports"]:
+        problemi.append(f"moduli importati al primo render: {', '.join(r['eager_imports'])}")
+
+    if problemi:
+        print("❌ REGRESSIONE: " + "; ".join(problemi))
+        sys.exit(1)
+    print("✅ Entro le soglie")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Cache su disco delle risposte OS1 - Partner Data
+Persiste le risposte REST in un file SQLite (payload JSON compressi con zlib),
+così dopo un riavvio/redeploy le prime domande non ripartono da chiamate a freddo via VPN.
+Sicura con più processi: SQLite in modalità WAL + busy timeout.
+Le risposte scadute (oltre ttl) restano disponibili fino a stale_ttl, per servire
+dati "vecchi ma noti" quando OS1 o la VPN non rispondono.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(endpoint, params=None):
+    """Chiave di cache stabile per endpoint + parametri (stessa per memoria e disco)."""
+    params = params or {}
+    items = sorted((k, str(v)) for k, v in params.items() if v is not None)
+    return endpoint + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+
+class DiskCache:
+    def __init__(self, path, ttl=900, max_bytes=50 * 1024 * 1024, stale_ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS risposte (
+                    chiave      TEXT PRIMARY KEY,
+                    payload     BLOB NOT NULL,
+                    dimensione  INTEGER NOT NULL,
+                    salvato_il  REAL NOT NULL,
+                    usato_il    REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_usato_il ON risposte (usato_il)")
+
+    @contextmanager
+    def _connect(self):
+        # Una connessione per operazione: niente stato condiviso tra thread/processi
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA busy_timeout=10000")
+            with conn:  # commit/rollback automatico
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, max_age=None):
+        """Restituisce (dati, salvato_il) se presente e più recente di max_age
+        (default: ttl), altrimenti None."""
+        max_age = self.ttl if max_age is None else max_age
+        try:
+            with self._lock, self._connect() as conn:
+                row = conn.execute(
+                    "SELECT payload, salvato_il FROM risposte WHERE chiave = ?", (key,)
+                ).fetchone()
+                if not row:
+                    return None
+                payload, stored_at = row
+                if time.time() - stored_at > max_age:
+                    return None
+                conn.execute(
+                    "UPDATE risposte SET usato_il = ? WHERE chiave = ?", (time.time(), key)
+                )
+            return json.loads(zlib.decompress(payload)), stored_at
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            logger.warning(f"Lettura cache disco fallita per {key}: {e}")
+            return None
+
+    def set(self, key, data, stored_at=None):
+        """Salva la risposta compressa e applica l'eviction per dimensione."""
+        stored_at = stored_at or time.time()
+        try:
+            payload = zlib.compress(
+                json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+            )
+            with self._lock, self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO risposte VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), stored_at, time.time())
+                )
+                self._evict(conn)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Scrittura cache disco fallita per {key}: {e}")
+
+    def _evict(self, conn):
+        """Elimina le risposte oltre stale_ttl e, se oltre max_bytes, le meno usate di recente (LRU)."""
+        conn.execute("DELETE FROM risposte WHERE salvato_il < ?", (time.time() - self.stale_ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(dimensione), 0) FROM risposte").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT chiave, dimensione FROM risposte ORDER BY usato_il ASC"
+        ).fetchall():
+            conn.execute("DELETE FROM risposte WHERE chiave = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def recent(self, limit=200):
+        """Ultime risposte ancora servibili (più usate di recente), per scaldare la cache in memoria."""
+        try:
+            with self._lock, self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT chiave, payload, salvato_il FROM risposte "
+                    "WHERE salvato_il >= ? ORDER BY usato_il DESC LIMIT ?",
+                    (time.time() - self.stale_ttl, limit)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Warm-up cache disco fallito: {e}")
+            return []
+
+        entries = []
+        for key, payload, stored_at in rows:
+            try:
+                entries.append((key, json.loads(zlib.decompress(payload)), stored_at))
+            except (zlib.error, ValueError):
+                continue
+        return entries
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM risposte")
@@ -0,0 +1,2 @@
+# test_connessione.py è uno script manuale (non un modulo di test pytest)
+collect_ignore = ["test_connessione.py"]
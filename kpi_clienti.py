@@ -0,0 +1,602 @@
+"""
+Snapshot KPI per cliente - Partner Data
+Materializza in SQLite, per ogni cliente, i KPI più richiesti (fatturato mensile/annuale,
+offerte aperte per anzianità, ordini inevasi, ultima consegna) così il tool
+get_kpi_cliente risponde subito senza scaricare e far ragionare Claude sui documenti grezzi.
+
+I documenti vengono sincronizzati in modo incrementale: ad ogni giro si scaricano solo
+quelli dall'ultima sincronizzazione (meno qualche giorno di margine) e, per offerte e
+ordini, dalla data del più vecchio ancora aperto, per intercettare i cambi di stato.
+Un thread in background riaggiorna periodicamente i clienti già richiesti.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+KPI_DB_PATH = os.getenv("KPI_DB_PATH", ".cache/kpi_clienti.sqlite")
+KPI_REFRESH_INTERVAL = int(os.getenv("KPI_REFRESH_INTERVAL", "1800"))
+SYNC_OVERLAP_DAYS = 7
+# Ogni quanti giorni riscaricare tutto lo storico, per accorgersi dei documenti eliminati
+FULL_SYNC_DAYS = int(os.getenv("KPI_FULL_SYNC_DAYS", "1"))
+
+STATO_INEVASO = "inevaso"
+STATO_EVASO_PARZIALMENTE = "evaso parzialmente"
+
+# Nomi possibili dei campi nei documenti OS1 (confronto case-insensitive)
+CAMPI_ID = ("id", "iddocumento", "numerodocumento", "numdoc", "numero")
+CAMPI_DATA = ("datadocumento", "datadoc", "data_documento", "data")
+CAMPI_IMPORTO = ("totaledocumento", "totale", "totdoc", "importo", "imponibile")
+CAMPI_STATO = ("statodocumento", "stato", "evasione")
+CAMPI_TIPO = ("tipodocumento", "tipodoc", "tipo")
+CAMPI_RESIDUO = ("importoresiduo", "residuo", "totaleresiduo", "importodaevadere", "daevadere")
+
+# Tipo documento → metodo di OS1Client
+TIPI_DOCUMENTO = {
+    "fatture": "get_fatture_cliente",
+    "offerte": "get_offerte_cliente",
+    "ordini": "get_ordini_cliente",
+    "bolle": "get_bolle_cliente",
+}
+
+# Tipo documento → sezioni dello snapshot calcolate da quei documenti
+SEZIONI_PER_TIPO = {
+    "fatture": ("fatturato_per_anno", "fatturato_per_mese"),
+    "offerte": ("offerte_aperte",),
+    "ordini": ("ordini_inevasi",),
+    "bolle": ("consegne",),
+}
+
+FASCE_ANZIANITA = ((30, "0-30 giorni"), (60, "31-60 giorni"), (90, "61-90 giorni"))
+
+
+# ──────────────────────────────────────────────
+# LETTURA CAMPI DOCUMENTI
+# ──────────────────────────────────────────────
+
+def _campo(doc, candidati):
+    """Primo campo presente tra i candidati (nomi case-insensitive), altrimenti None."""
+    lower = {str(k).lower(): v for k, v in doc.items()}
+    for nome in candidati:
+        if lower.get(nome) not in (None, ""):
+            return lower[nome]
+    return None
+
+
+def _parse_data(value):
+    if not value:
+        return None
+    text = str(value).strip()
+    for fmt, size in (("%Y-%m-%d", 10), ("%d/%m/%Y", 10), ("%Y%m%d", 8)):
+        try:
+            return datetime.strptime(text[:size], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_importo(value):
+    """Importo come float, o None se assente o non interpretabile."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace("€", "").replace(" ", "")
+    if "," in text:
+        # Formato italiano: 1.234,56
+        text = text.replace(".", "").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _doc_id(doc):
+    """
+    Chiave stabile del documento, o None se non c'è un campo identificativo riconosciuto.
+    Serve una chiave vera: un hash del contenuto cambierebbe ad ogni modifica di stato o
+    importo e il documento verrebbe contato due volte.
+    """
+    ident = _campo(doc, CAMPI_ID)
+    if ident is None:
+        return None
+    # Fatture e note di credito possono condividere la numerazione
+    tipo = _campo(doc, CAMPI_TIPO)
+    return f"{tipo}:{ident}" if tipo else str(ident)
+
+
+def _importo_firmato(doc):
+    """Importo del documento, negativo per le note di credito. None se non interpretabile."""
+    importo = _parse_importo(_campo(doc, CAMPI_IMPORTO))
+    if importo is None:
+        return None
+    tipo = str(_campo(doc, CAMPI_TIPO) or "").lower()
+    if "nota" in tipo and "credito" in tipo and importo > 0:
+        importo = -importo
+    return importo
+
+
+# ──────────────────────────────────────────────
+# CALCOLO KPI
+# ──────────────────────────────────────────────
+
+def _stato(doc):
+    stato = _campo(doc, CAMPI_STATO)
+    return str(stato).strip().lower() if stato is not None else None
+
+
+def calcola_kpi(documenti, oggi=None):
+    """
+    Calcola lo snapshot KPI dai documenti di un cliente ({tipo: [doc, ...]}).
+
+    I documenti con campi non riconosciuti (data, importo, stato) sono esclusi dai totali e
+    contati in "documenti_non_interpretati". Se nessun documento di un tipo è interpretabile
+    la sezione corrispondente è None e il motivo è in "errori"; se non è interpretabile nessun
+    documento lo snapshot è solo {"error": ...}. Mai zeri al posto dei dati.
+    """
+    oggi = oggi or date.today()
+    non_interpretati = {}
+
+    def scarta(tipo):
+        non_interpretati[tipo] = non_interpretati.get(tipo, 0) + 1
+
+    fatturato_anno, fatturato_mese = {}, {}
+    for doc in documenti.get("fatture", []):
+        data = _parse_data(_campo(doc, CAMPI_DATA))
+        importo = _importo_firmato(doc)
+        if not data or importo is None:
+            scarta("fatture")
+            continue
+        anno, mese = str(data.year), data.strftime("%Y-%m")
+        fatturato_anno[anno] = fatturato_anno.get(anno, 0.0) + importo
+        fatturato_mese[mese] = fatturato_mese.get(mese, 0.0) + importo
+
+    fasce = {etichetta: {"numero": 0, "totale": 0.0} for _, etichetta in FASCE_ANZIANITA}
+    fasce["oltre 90 giorni"] = {"numero": 0, "totale": 0.0}
+    offerte_aperte = []
+    for doc in documenti.get("offerte", []):
+        stato = _stato(doc)
+        data = _parse_data(_campo(doc, CAMPI_DATA))
+        importo = _importo_firmato(doc)
+        if stato is None or not data or importo is None:
+            scarta("offerte")
+            continue
+        if stato != STATO_INEVASO:
+            continue
+        giorni = (oggi - data).days
+        etichetta = "oltre 90 giorni"
+        for limite, nome in FASCE_ANZIANITA:
+            if giorni <= limite:
+                etichetta = nome
+                break
+        fasce[etichetta]["numero"] += 1
+        fasce[etichetta]["totale"] += importo
+        offerte_aperte.append({
+            "numero": _campo(doc, CAMPI_ID),
+            "data": data.isoformat(),
+            "importo": importo,
+            "giorni": giorni,
+        })
+    offerte_aperte.sort(key=lambda o: o["giorni"], reverse=True)
+
+    ordini_inevasi = []
+    for doc in documenti.get("ordini", []):
+        stato = _stato(doc)
+        data = _parse_data(_campo(doc, CAMPI_DATA))
+        importo = _importo_firmato(doc)
+        if stato is None or not data or importo is None:
+            scarta("ordini")
+            continue
+        if stato not in (STATO_INEVASO, STATO_EVASO_PARZIALMENTE):
+            continue
+        # Evaso parzialmente: da evadere è solo il residuo, se OS1 lo indica
+        da_evadere = importo
+        if stato == STATO_EVASO_PARZIALMENTE:
+            da_evadere = _parse_importo(_campo(doc, CAMPI_RESIDUO))
+        ordini_inevasi.append({
+            "numero": _campo(doc, CAMPI_ID),
+            "data": data.isoformat(),
+            "importo": importo,
+            "da_evadere": da_evadere,
+            "stato": stato,
+        })
+    ordini_inevasi.sort(key=lambda o: o["data"])
+    senza_residuo = [o for o in ordini_inevasi if o["da_evadere"] is None]
+
+    date_bolle = []
+    for doc in documenti.get("bolle", []):
+        data = _parse_data(_campo(doc, CAMPI_DATA))
+        if not data:
+            scarta("bolle")
+            continue
+        date_bolle.append(data)
+    un_anno_fa = oggi - timedelta(days=365)
+
+    snapshot = {
+        "fatturato_per_anno": dict(sorted(fatturato_anno.items())),
+        "fatturato_per_mese": dict(sorted(fatturato_mese.items())),
+        "offerte_aperte": {
+            "numero": len(offerte_aperte),
+            "totale": sum(o["importo"] for o in offerte_aperte),
+            "per_anzianita": fasce,
+            "piu_vecchie": offerte_aperte[:10],
+        },
+        "ordini_inevasi": {
+            "numero": len(ordini_inevasi),
+            "totale_da_evadere": sum(o["da_evadere"] or 0.0 for o in ordini_inevasi),
+            # Evasi parzialmente di cui OS1 non dà il residuo: solo il valore intero dell'ordine
+            "evasi_parzialmente_senza_residuo": {
+                "numero": len(senza_residuo),
+                "valore_ordini": sum(o["importo"] for o in senza_residuo),
+            },
+            "ordini": ordini_inevasi[:20],
+        },
+        "consegne": {
+            "ultima_consegna": max(date_bolle).isoformat() if date_bolle else None,
+            "bolle_ultimi_12_mesi": sum(1 for d in date_bolle if d >= un_anno_fa),
+        },
+    }
+
+    if senza_residuo:
+        snapshot["ordini_inevasi"]["nota"] = (
+            f"{len(senza_residuo)} ordini evasi parzialmente senza importo residuo in OS1: "
+            "non sono in totale_da_evadere, il loro valore intero (già in parte evaso) è in "
+            "evasi_parzialmente_senza_residuo"
+        )
+    if non_interpretati:
+        snapshot["documenti_non_interpretati"] = non_interpretati
+    errori = {}
+    for tipo, sezioni in SEZIONI_PER_TIPO.items():
+        totale_documenti = len(documenti.get(tipo, []))
+        if totale_documenti and non_interpretati.get(tipo, 0) == totale_documenti:
+            errori[tipo] = (
+                f"Campi dei {totale_documenti} documenti '{tipo}' non riconosciuti: "
+                f"usa {TIPI_DOCUMENTO[tipo]} per i dati di dettaglio"
+            )
+            for sezione in sezioni:
+                snapshot[sezione] = None
+    if errori and len(errori) == sum(1 for tipo in SEZIONI_PER_TIPO if documenti.get(tipo)):
+        # Nessun documento interpretabile: un errore, non uno snapshot di zeri
+        return {"error": "KPI non disponibili. " + " ".join(errori.values())}
+    if errori:
+        snapshot["errori"] = errori
+    return snapshot
+
+
+# ──────────────────────────────────────────────
+# STORE SQLITE + SINCRONIZZAZIONE INCREMENTALE
+# ──────────────────────────────────────────────
+
+class KPIStore:
+    def __init__(self, path=KPI_DB_PATH, refresh_interval=KPI_REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._sync_finito = threading.Condition(self._lock)
+        self._in_sync = set()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documenti (
+                    cliente     TEXT NOT NULL,
+                    tipo        TEXT NOT NULL,
+                    id_doc      TEXT NOT NULL,
+                    data        TEXT,
+                    payload     TEXT NOT NULL,
+                    PRIMARY KEY (cliente, tipo, id_doc)
+                );
+                CREATE TABLE IF NOT EXISTS sincronizzazioni (
+                    cliente     TEXT NOT NULL,
+                    tipo        TEXT NOT NULL,
+                    sync_fino_al TEXT NOT NULL,
+                    sync_completo_il TEXT,
+                    PRIMARY KEY (cliente, tipo)
+                );
+                CREATE TABLE IF NOT EXISTS snapshot (
+                    cliente         TEXT PRIMARY KEY,
+                    payload         TEXT NOT NULL,
+                    aggiornato_il   REAL NOT NULL
+                );
+                """
+            )
+            columns = [r[1] for r in conn.execute("PRAGMA table_info(sincronizzazioni)")]
+            if "sync_completo_il" not in columns:
+                # Store creato prima del sync completo periodico
+                conn.execute("ALTER TABLE sincronizzazioni ADD COLUMN sync_completo_il TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA busy_timeout=10000")
+            with conn:  # commit/rollback automatico
+                yield conn
+        finally:
+            conn.close()
+
+    def _salva_errore(self, cliente, messaggio):
+        """Sostituisce lo snapshot con un errore: meglio nessun KPI che KPI sbagliati."""
+        logger.warning(f"KPI cliente {cliente}: {messaggio}")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?)",
+                (cliente, json.dumps({"error": messaggio}, ensure_ascii=False), time.time())
+            )
+
+    def get_snapshot(self, id_cliente):
+        """Snapshot KPI salvato per il cliente, con "aggiornato_il" (epoch), o None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, aggiornato_il FROM snapshot WHERE cliente = ?", (str(id_cliente),)
+            ).fetchone()
+        if not row:
+            return None
+        snapshot = json.loads(row[0])
+        snapshot["aggiornato_il"] = row[1]
+        return snapshot
+
+    def get_kpi(self, os1_client, id_cliente, anno=None):
+        """
+        Come _get_kpi, e registra lo snapshot letto come dipendenza nel RequestLog attivo
+        (la cache delle risposte lo usa per invalidare le risposte basate sui KPI).
+        """
+        log = os1_client.current_request_log()
+        try:
+            kpi = self._get_kpi(os1_client, id_cliente, anno)
+        except Exception:
+            # Es. primo sync con OS1 giù: la risposta non va salvata in cache
+            if log is not None:
+                log.failed = True
+            raise
+        if log is not None:
+            if "error" in kpi:
+                log.failed = True
+            elif "_avviso" in kpi:
+                log.stale = True
+            else:
+                log.kpi_clienti.append(str(id_cliente))
+        return kpi
+
+    def fingerprint(self, os1_client, id_cliente):
+        """Hash dello snapshot attuale (aggiornato se vecchio), None se non disponibile/aggiornato."""
+        with os1_client.track_requests() as log:
+            kpi = self._get_kpi(os1_client, id_cliente)
+        if log.stale or "error" in kpi or "_avviso" in kpi:
+            return None
+        kpi.pop("aggiornato_il", None)
+        return hashlib.sha1(
+            json.dumps(kpi, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    def _get_kpi(self, os1_client, id_cliente, anno=None):
+        """
+        KPI del cliente per il tool get_kpi_cliente: legge lo snapshot (istantaneo).
+        Se il cliente non è mai stato materializzato, o lo snapshot è più vecchio di
+        refresh_interval (es. dopo un riavvio), lo sincronizza ora; se OS1 non risponde
+        restituisce lo snapshot vecchio con un avviso.
+        """
+        snapshot = self.get_snapshot(id_cliente)
+        if snapshot is None:
+            self.sync_cliente(os1_client, id_cliente, attendi=True)
+            snapshot = self.get_snapshot(id_cliente)
+            if snapshot is None:
+                return {"error": f"KPI non disponibili per il cliente {id_cliente}"}
+        elif time.time() - snapshot["aggiornato_il"] > self.refresh_interval:
+            try:
+                self.sync_cliente(os1_client, id_cliente, attendi=True)
+            except Exception as e:
+                logger.warning(f"Aggiornamento KPI cliente {id_cliente} fallito: {e}")
+            snapshot = self.get_snapshot(id_cliente)
+            if time.time() - snapshot["aggiornato_il"] > self.refresh_interval:
+                snapshot["_avviso"] = (
+                    "KPI non aggiornati (gestionale non raggiungibile): "
+                    "indica la data di aggiornamento nella risposta"
+                )
+        if "error" in snapshot:
+            return {"error": snapshot["error"]}
+
+        if anno and snapshot["fatturato_per_mese"] is not None:
+            snapshot["fatturato_per_mese"] = {
+                mese: tot for mese, tot in snapshot["fatturato_per_mese"].items()
+                if mese.startswith(str(anno))
+            }
+        snapshot["aggiornato_il"] = time.strftime(
+            "%d/%m/%Y %H:%M", time.localtime(snapshot["aggiornato_il"])
+        )
+        return snapshot
+
+    def clienti(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute("SELECT cliente FROM snapshot")]
+
+    def _data_inizio(self, conn, cliente, tipo):
+        """
+        Da quale data riscaricare: ultimo sync meno margine, o più vecchio doc aperto.
+        None = tutto lo storico (primo sync, o ultimo sync completo più vecchio di FULL_SYNC_DAYS).
+        """
+        row = conn.execute(
+            "SELECT sync_fino_al, sync_completo_il FROM sincronizzazioni "
+            "WHERE cliente = ? AND tipo = ?",
+            (cliente, tipo)
+        ).fetchone()
+        if not row or not row[1]:
+            return None
+        if date.fromisoformat(row[1]) <= date.today() - timedelta(days=FULL_SYNC_DAYS):
+            return None
+
+        inizio = date.fromisoformat(row[0]) - timedelta(days=SYNC_OVERLAP_DAYS)
+        if tipo in ("offerte", "ordini"):
+            for data, payload in conn.execute(
+                "SELECT data, payload FROM documenti WHERE cliente = ? AND tipo = ? AND data IS NOT NULL",
+                (cliente, tipo)
+            ):
+                stato = str(_campo(json.loads(payload), CAMPI_STATO) or "").strip().lower()
+                if stato in (STATO_INEVASO, STATO_EVASO_PARZIALMENTE):
+                    inizio = min(inizio, date.fromisoformat(data))
+        return inizio
+
+    def sync_cliente(self, os1_client, id_cliente, attendi=False):
+        """
+        Scarica i documenti nuovi/modificati del cliente e ricalcola lo snapshot.
+        Se il cliente è già in sincronizzazione (es. dal job in background) restituisce
+        False subito, o con attendi=True dopo che quella sincronizzazione è finita.
+        """
+        cliente = str(id_cliente)
+        with self._sync_finito:
+            if cliente in self._in_sync:
+                if attendi:
+                    self._sync_finito.wait_for(lambda: cliente not in self._in_sync)
+                return False
+            self._in_sync.add(cliente)
+
+        # Le chiamate del sync non sono dipendenze della domanda in corso, ma errori e dati
+        # vecchi sì: vanno riportati nel RequestLog esterno
+        outer_log = os1_client.current_request_log()
+        try:
+            oggi = date.today()
+            for tipo, metodo in TIPI_DOCUMENTO.items():
+                with self._connect() as conn:
+                    inizio = self._data_inizio(conn, cliente, tipo)
+
+                with os1_client.track_requests() as request_log:
+                    try:
+                        docs = getattr(os1_client, metodo)(
+                            id_cliente=cliente,
+                            data_da=inizio.isoformat() if inizio else None
+                        ) or []
+                    finally:
+                        if outer_log is not None:
+                            outer_log.failed |= request_log.failed
+                            outer_log.stale |= request_log.stale
+                if request_log.stale:
+                    # OS1 non raggiungibile: non avanzare la sincronizzazione con dati vecchi
+                    logger.warning(f"Sync KPI cliente {cliente} rimandata: OS1 non raggiungibile")
+                    return False
+                if isinstance(docs, dict):
+                    docs = [docs]
+                docs = [doc for doc in docs if isinstance(doc, dict)]
+
+                righe = {}
+                for doc in docs:
+                    id_doc = _doc_id(doc)
+                    if id_doc is None:
+                        self._salva_errore(
+                            cliente,
+                            f"KPI non disponibili: documenti '{tipo}' senza numero documento "
+                            "riconoscibile, usa i tool di dettaglio"
+                        )
+                        return False
+                    data = _parse_data(_campo(doc, CAMPI_DATA))
+                    righe[id_doc] = (data.isoformat() if data else None,
+                                     json.dumps(doc, ensure_ascii=False, default=str))
+
+                with self._connect() as conn:
+                    # Documenti nel periodo riscaricato ma non più restituiti: eliminati in OS1
+                    if inizio is None:
+                        esistenti = conn.execute(
+                            "SELECT id_doc FROM documenti WHERE cliente = ? AND tipo = ?",
+                            (cliente, tipo)
+                        ).fetchall()
+                    else:
+                        esistenti = conn.execute(
+                            "SELECT id_doc FROM documenti WHERE cliente = ? AND tipo = ? AND data >= ?",
+                            (cliente, tipo, inizio.isoformat())
+                        ).fetchall()
+                    for (id_doc,) in esistenti:
+                        if id_doc not in righe:
+                            conn.execute(
+                                "DELETE FROM documenti WHERE cliente = ? AND tipo = ? AND id_doc = ?",
+                                (cliente, tipo, id_doc)
+                            )
+                    for id_doc, (data, payload) in righe.items():
+                        conn.execute(
+                            "INSERT OR REPLACE INTO documenti VALUES (?, ?, ?, ?, ?)",
+                            (cliente, tipo, id_doc, data, payload)
+                        )
+                    conn.execute(
+                        "INSERT INTO sincronizzazioni VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (cliente, tipo) DO UPDATE SET sync_fino_al = excluded.sync_fino_al, "
+                        "sync_completo_il = COALESCE(excluded.sync_completo_il, sync_completo_il)",
+                        (cliente, tipo, oggi.isoformat(), None if inizio else oggi.isoformat())
+                    )
+
+            with self._connect() as conn:
+                documenti = {tipo: [] for tipo in TIPI_DOCUMENTO}
+                for tipo, payload in conn.execute(
+                    "SELECT tipo, payload FROM documenti WHERE cliente = ?", (cliente,)
+                ):
+                    documenti[tipo].append(json.loads(payload))
+                snapshot = calcola_kpi(documenti, oggi)
+                conn.execute(
+                    "INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?)",
+                    (cliente, json.dumps(snapshot, ensure_ascii=False), time.time())
+                )
+            logger.info(f"Snapshot KPI aggiornato per cliente {cliente}")
+            return True
+        finally:
+            with self._sync_finito:
+                self._in_sync.discard(cliente)
+                self._sync_finito.notify_all()
+
+
+class KPIRefresher:
+    """Job in background: riaggiorna periodicamente gli snapshot dei clienti già richiesti."""
+
+    def __init__(self, store, os1_client, interval=KPI_REFRESH_INTERVAL):
+        self.store = store
+        self.os1_client = os1_client
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kpi-refresh", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Primo giro subito: dopo un riavvio gli snapshot su disco possono essere vecchi di giorni
+        while True:
+            self.refresh_once()
+            if self._stop.wait(self.interval):
+                break
+
+    def refresh_once(self):
+        """Sincronizza i clienti con snapshot più vecchio dell'intervallo."""
+        for cliente in self.store.clienti():
+            if self._stop.is_set() or self.os1_client.breaker.is_open:
+                break
+            snapshot = self.store.get_snapshot(cliente)
+            if snapshot and time.time() - snapshot["aggiornato_il"] < self.interval:
+                continue
+            try:
+                self.store.sync_cliente(self.os1_client, cliente)
+            except Exception as e:
+                logger.warning(f"Aggiornamento KPI cliente {cliente} fallito: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(os1_client):
+    """Store condiviso dal processo: al primo uso avvia anche il job di refresh in background."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KPIStore()
+            KPIRefresher(_store, os1_client).start()
+        return _store
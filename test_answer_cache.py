@@ -0,0 +1,180 @@
+"""
+Test cache delle risposte: domande che differiscono per stato, mese o aggregazione
+non devono mai condividere la risposta, anche se il testo è molto simile.
+
+Uso: python -m pytest
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import kpi_clienti
+from answer_cache import AnswerCache, extract_entities
+
+
+class FakeOS1:
+    """Stub di OS1Client: fingerprint fisso per endpoint, None se "OS1 è giù"."""
+
+    def __init__(self):
+        self.digests = {}
+        self.down = False
+        self.errors = {}  # endpoint -> eccezione sollevata da fingerprint
+        self.calls = 0
+        self.breaker = SimpleNamespace(is_open=False)
+
+    def fingerprint(self, endpoint, params=None):
+        self.calls += 1
+        if endpoint in self.errors:
+            raise self.errors[endpoint]
+        if self.down:
+            return None
+        return self.digests.get(endpoint, "v1")
+
+
+def _log(*endpoints, kpi_clienti=()):
+    return SimpleNamespace(
+        requests=[(endpoint, {"idcliente": "444"}) for endpoint in endpoints],
+        stale=False,
+        failed=False,
+        kpi_clienti=list(kpi_clienti),
+    )
+
+
+def _cache_con(domanda, risposta, os1, endpoint="/erp/ordiniclienti"):
+    cache = AnswerCache(threshold=0.85)
+    cache.store(domanda, risposta, os1, _log(endpoint))
+    return cache
+
+
+def test_stato_documento_fa_parte_della_chiave():
+    os1 = FakeOS1()
+    cache = _cache_con("Ordini inevasi del cliente 444", "3 ordini inevasi", os1)
+
+    assert cache.lookup("Ordini evasi del cliente 444", os1) is None
+    assert cache.lookup("Ordini evasi parzialmente del cliente 444", os1) is None
+    assert cache.lookup("ordini inevasi cliente 444?", os1) == "3 ordini inevasi"
+
+
+def test_mese_fa_parte_della_chiave():
+    os1 = FakeOS1()
+    cache = _cache_con(
+        "fatture del cliente 444 di marzo 2024", "2 fatture a marzo", os1, "/erp/fattureclienti"
+    )
+
+    assert cache.lookup("fatture del cliente 444 di aprile 2024", os1) is None
+    assert cache.lookup("Fatture del cliente 444 di marzo 2024?", os1) == "2 fatture a marzo"
+
+
+def test_aggregazione_fa_parte_della_chiave():
+    os1 = FakeOS1()
+    cache = _cache_con(
+        "Fatture del cliente 444 nel 2024", "elenco fatture", os1, "/erp/fattureclienti"
+    )
+
+    assert cache.lookup("Fatturato del cliente 444 nel 2024", os1) is None
+    assert cache.lookup("Numero fatture del cliente 444 nel 2024", os1) is None
+
+
+def test_sinonimi_stato_coincidono():
+    assert extract_entities("Offerte aperte del cliente 444") == extract_entities(
+        "Offerte inevase del cliente 444"
+    )
+    assert extract_entities("primo trimestre 2024 fatture cliente 444") == extract_entities(
+        "Q1 2024 fatture cliente 444"
+    )
+
+
+def test_dati_cambiati_invalidano_la_risposta():
+    os1 = FakeOS1()
+    cache = _cache_con("Ordini inevasi del cliente 444", "3 ordini inevasi", os1)
+
+    os1.digests["/erp/ordiniclienti"] = "v2"
+    assert cache.lookup("Ordini inevasi del cliente 444", os1) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_domanda_senza_cliente_non_cacheabile():
+    os1 = FakeOS1()
+    cache = AnswerCache()
+    cache.store("e nel 2023?", "risposta", os1, _log("/erp/fattureclienti"))
+
+    assert cache.stats()["entries"] == 0
+    assert cache.lookup("e nel 2023?", os1) is None
+
+
+def test_os1_non_raggiungibile_non_rimuove_la_voce():
+    os1 = FakeOS1()
+    cache = _cache_con("Ordini inevasi del cliente 444", "3 ordini inevasi", os1)
+
+    os1.down = True
+    assert cache.lookup("Ordini inevasi del cliente 444", os1) is None
+    assert cache.stats()["entries"] == 1
+
+    os1.down = False
+    assert cache.lookup("Ordini inevasi del cliente 444", os1) == "3 ordini inevasi"
+
+
+def test_errore_nel_verificare_una_dipendenza_e_un_miss():
+    os1 = FakeOS1()
+    cache = _cache_con("Ordini inevasi del cliente 444", "3 ordini inevasi", os1)
+
+    os1.errors["/erp/ordiniclienti"] = ValueError("404 Not Found")
+    assert cache.lookup("Ordini inevasi del cliente 444", os1) is None
+    assert cache.stats()["entries"] == 1
+
+    del os1.errors["/erp/ordiniclienti"]
+    assert cache.lookup("Ordini inevasi del cliente 444", os1) == "3 ordini inevasi"
+
+
+def test_breaker_aperto_non_verifica_le_dipendenze():
+    os1 = FakeOS1()
+    cache = _cache_con("Ordini inevasi del cliente 444", "3 ordini inevasi", os1)
+    os1.calls = 0
+
+    os1.breaker.is_open = True
+    assert cache.lookup("Ordini inevasi del cliente 444", os1) is None
+    assert os1.calls == 0
+    assert cache.stats()["entries"] == 1
+
+
+def test_snapshot_kpi_cambiato_invalida_la_risposta(monkeypatch):
+    os1 = FakeOS1()
+    kpi_store = SimpleNamespace(digest="k1")
+    kpi_store.fingerprint = lambda os1_client, id_cliente: kpi_store.digest
+    monkeypatch.setattr(kpi_clienti, "get_store", lambda os1_client: kpi_store)
+
+    # Risposta basata solo su cerca_cliente + get_kpi_cliente
+    cache = AnswerCache()
+    cache.store(
+        "Fatturato del cliente 444 nel 2024", "€100", os1,
+        _log("/erp/cliente/444", kpi_clienti=["444"])
+    )
+    assert cache.lookup("Fatturato del cliente 444 nel 2024", os1) == "€100"
+
+    kpi_store.digest = "k2"  # nuova fattura materializzata nello snapshot
+    assert cache.lookup("Fatturato del cliente 444 nel 2024", os1) is None
+
+
+@pytest.mark.parametrize("domanda, diversa", [
+    ("Ordini del cliente 444 per tessere RFID", "Ordini del cliente 444 per tessere combo"),
+    ("Fatture del cliente 444 sopra 1000 euro", "Fatture del cliente 444 sopra 5000 euro"),
+    ("Ordini del cliente 444 dell'agente 12", "Ordini del cliente 444 dell'agente 15"),
+    ("Fatture del cliente 444 superiore a 500", "Fatture del cliente 444 inferiore a 500"),
+    ("Ordini consegnati del cliente 444", "Ordini non consegnati del cliente 444"),
+    ("Fatture pagate del cliente 444", "Fatture non pagate del cliente 444"),
+    ("Fatture del cliente 444 dal 2022 al 2024", "Fatture del cliente 444 nel 2022 e nel 2024"),
+])
+def test_domande_con_significato_diverso_non_condividono_la_risposta(domanda, diversa):
+    os1 = FakeOS1()
+    cache = _cache_con(domanda, "risposta", os1)
+
+    assert cache.lookup(diversa, os1) is None
+    assert cache.lookup(domanda, os1) == "risposta"
+
+
+def test_parole_vuote_e_sinonimi_noti_restano_un_hit():
+    os1 = FakeOS1()
+    cache = _cache_con("Quali sono le tessere ordinate dal cliente 444?", "10 tessere", os1)
+
+    assert cache.lookup("tessera ordinate cliente 444", os1) == "10 tessere"
@@ -22,8 +22,14 @@ streamlit run app.py
 
 ## Struttura
 
-- `app.py` — Interfaccia Streamlit + Claude function calling loop
-- `api_os1.py` — Client API OS1 (autenticazione JWT + chiamate REST)
+- `app.py` — Interfaccia Streamlit (rieseguita ad ogni interazione, import pesanti lazy)
+- `assistente.py` — System prompt + Claude function calling loop
+- `tools_os1.py` — Registro tools: schema per Claude e dispatch da un'unica definizione
+- `api_os1.py` — Client API OS1 (autenticazione JWT + chiamate REST, cache, circuit breaker)
+- `cache_os1.py` — Cache su disco (SQLite) delle risposte OS1
+- `answer_cache.py` — Cache delle risposte a domande ripetute
+- `kpi_clienti.py` — Snapshot KPI per cliente aggiornati in background
+- `bench_avvio.py` — Benchmark cold start / rerun di app.py
 - `test_connessione.py` — Script test rapido connessione
 
 ## Note
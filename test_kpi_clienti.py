@@ -0,0 +1,267 @@
+"""
+Test snapshot KPI: sincronizzazione incrementale con uno stub di OS1Client.
+
+Uso: python -m pytest
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import kpi_clienti
+from kpi_clienti import KPIStore
+
+
+class FakeOS1:
+    """Stub di OS1Client: documenti in memoria per tipo, filtro data_da come OS1."""
+
+    def __init__(self):
+        self.docs = {"fatture": [], "offerte": [], "ordini": [], "bolle": []}
+        self.stale = False
+        self.down = False
+        self.breaker = SimpleNamespace(is_open=False)
+        self._log = None
+
+    @contextmanager
+    def track_requests(self):
+        previous = self._log
+        self._log = SimpleNamespace(requests=[], stale=False, failed=False, kpi_clienti=[])
+        try:
+            yield self._log
+        finally:
+            self._log = previous
+
+    def current_request_log(self):
+        return self._log
+
+    def _filtra(self, tipo, data_da):
+        if self.down:
+            # Come OS1Client._get senza dati in cache: segna la chiamata fallita e rilancia
+            if self._log is not None:
+                self._log.failed = True
+            raise ConnectionError("OS1 non raggiungibile")
+        if self._log is not None:
+            self._log.stale = self.stale
+        return [d for d in self.docs[tipo] if not data_da or d["DataDocumento"] >= data_da]
+
+    def get_fatture_cliente(self, id_cliente=None, data_da=None):
+        return self._filtra("fatture", data_da)
+
+    def get_offerte_cliente(self, id_cliente=None, data_da=None):
+        return self._filtra("offerte", data_da)
+
+    def get_ordini_cliente(self, id_cliente=None, data_da=None):
+        return self._filtra("ordini", data_da)
+
+    def get_bolle_cliente(self, id_cliente=None, data_da=None):
+        return self._filtra("bolle", data_da)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return KPIStore(str(tmp_path / "kpi.sqlite"))
+
+
+def _offerta(numero, stato, data="2024-01-10", totale=100):
+    return {"NumeroDocumento": numero, "DataDocumento": data, "Totale": totale, "Stato": stato}
+
+
+def test_cambio_stato_offerta_aggiorna_lo_stesso_documento(store):
+    os1 = FakeOS1()
+    os1.docs["offerte"] = [_offerta("O1", "inevaso")]
+    store.sync_cliente(os1, "444")
+    assert store.get_snapshot("444")["offerte_aperte"]["numero"] == 1
+
+    os1.docs["offerte"] = [_offerta("O1", "evaso totalmente")]
+    store.sync_cliente(os1, "444")
+    assert store.get_snapshot("444")["offerte_aperte"]["numero"] == 0
+
+
+def test_documento_eliminato_in_os1_viene_rimosso(store, monkeypatch):
+    oggi = date.today().isoformat()
+    os1 = FakeOS1()
+    os1.docs["fatture"] = [
+        {"NumeroDocumento": "F1", "DataDocumento": "2024-03-01", "Totale": 100},
+        {"NumeroDocumento": "F2", "DataDocumento": "2024-03-02", "Totale": 50},
+        {"NumeroDocumento": "F3", "DataDocumento": oggi, "Totale": 10},
+    ]
+    store.sync_cliente(os1, "444")
+
+    # Sync incrementale: intercetta le eliminazioni nel periodo riscaricato
+    os1.docs["fatture"] = os1.docs["fatture"][:2]
+    store.sync_cliente(os1, "444")
+    assert store.get_snapshot("444")["fatturato_per_anno"] == {"2024": 150.0}
+
+    # Sync completo (FULL_SYNC_DAYS scaduto): intercetta anche quelle più vecchie
+    monkeypatch.setattr(kpi_clienti, "FULL_SYNC_DAYS", 0)
+    os1.docs["fatture"] = os1.docs["fatture"][:1]
+    store.sync_cliente(os1, "444")
+    assert store.get_snapshot("444")["fatturato_per_anno"] == {"2024": 100.0}
+
+
+def test_documenti_senza_chiave_non_vengono_materializzati(store):
+    os1 = FakeOS1()
+    os1.docs["fatture"] = [{"DataDocumento": "2024-03-01", "Totale": 100}]
+
+    assert store.sync_cliente(os1, "444") is False
+    assert "error" in store.get_kpi(os1, "444")
+
+
+def test_campi_non_riconosciuti_danno_errore_non_zeri(store):
+    os1 = FakeOS1()
+    os1.docs["fatture"] = [{"NumeroDocumento": "F1", "dtdoc": "2024-03-01", "importodoc": 100}]
+    store.sync_cliente(os1, "444")
+
+    kpi = store.get_kpi(os1, "444")
+    assert "error" in kpi
+    assert "fatture" in kpi["error"]
+
+
+def test_documenti_parzialmente_interpretati_sono_segnalati(store):
+    os1 = FakeOS1()
+    os1.docs["fatture"] = [
+        {"NumeroDocumento": "F1", "DataDocumento": "2024-03-01", "Totale": 100},
+        {"NumeroDocumento": "F2", "DataDocumento": "2024-03-02", "Totale": "n/d"},
+    ]
+    os1.docs["offerte"] = [{"NumeroDocumento": "O1", "DataDocumento": "2024-01-10", "Totale": 5}]
+    store.sync_cliente(os1, "444")
+
+    kpi = store.get_kpi(os1, "444")
+    assert kpi["fatturato_per_anno"] == {"2024": 100.0}
+    assert kpi["documenti_non_interpretati"] == {"fatture": 1, "offerte": 1}
+    assert kpi["offerte_aperte"] is None
+    assert "offerte" in kpi["errori"]
+
+
+def _invecchia_snapshot(store, cliente, secondi):
+    with store._connect() as conn:
+        conn.execute(
+            "UPDATE snapshot SET aggiornato_il = aggiornato_il - ? WHERE cliente = ?",
+            (secondi, cliente)
+        )
+
+
+def test_snapshot_vecchio_viene_risincronizzato(store):
+    os1 = FakeOS1()
+    os1.docs["offerte"] = [_offerta("O1", "inevaso")]
+    store.sync_cliente(os1, "444")
+    _invecchia_snapshot(store, "444", store.refresh_interval + 60)
+
+    os1.docs["offerte"] = [_offerta("O1", "evaso totalmente")]
+    kpi = store.get_kpi(os1, "444")
+    assert kpi["offerte_aperte"]["numero"] == 0
+    assert "_avviso" not in kpi
+
+
+def test_snapshot_vecchio_con_os1_giu_ha_avviso(store):
+    os1 = FakeOS1()
+    os1.docs["offerte"] = [_offerta("O1", "inevaso")]
+    store.sync_cliente(os1, "444")
+    _invecchia_snapshot(store, "444", store.refresh_interval + 60)
+
+    os1.stale = True
+    kpi = store.get_kpi(os1, "444")
+    assert kpi["offerte_aperte"]["numero"] == 1
+    assert "_avviso" in kpi
+
+
+def test_refresher_primo_giro_immediato(store):
+    os1 = FakeOS1()
+    os1.docs["offerte"] = [_offerta("O1", "inevaso")]
+    store.sync_cliente(os1, "444")
+    _invecchia_snapshot(store, "444", store.refresh_interval + 60)
+    os1.docs["offerte"] = []
+
+    refresher = kpi_clienti.KPIRefresher(store, os1, interval=store.refresh_interval).start()
+    scadenza = time.time() + 5
+    while store.get_snapshot("444")["offerte_aperte"]["numero"] and time.time() < scadenza:
+        time.sleep(0.05)
+    refresher.stop()
+    assert store.get_snapshot("444")["offerte_aperte"]["numero"] == 0
+
+
+def test_get_kpi_registra_lo_snapshot_come_dipendenza(store):
+    os1 = FakeOS1()
+    os1.docs["fatture"] = [{"NumeroDocumento": "F1", "DataDocumento": "2024-03-01", "Totale": 100}]
+
+    with os1.track_requests() as log:
+        store.get_kpi(os1, "444")  # primo sync: le chiamate OS1 interne non contano
+    assert log.kpi_clienti == ["444"]
+
+    prima = store.fingerprint(os1, "444")
+    os1.docs["fatture"].append(
+        {"NumeroDocumento": "F2", "DataDocumento": date.today().isoformat(), "Totale": 50}
+    )
+    store.sync_cliente(os1, "444")
+    assert store.fingerprint(os1, "444") != prima
+
+
+def test_errore_nel_primo_sync_segna_la_domanda_come_fallita(store):
+    os1 = FakeOS1()
+    os1.down = True
+
+    with os1.track_requests() as log:
+        with pytest.raises(ConnectionError):
+            store.get_kpi(os1, "444")
+    assert log.failed
+    assert log.kpi_clienti == []
+
+
+def test_dati_vecchi_nel_sync_sono_riportati_alla_domanda(store):
+    os1 = FakeOS1()
+    os1.stale = True
+
+    with os1.track_requests() as log:
+        store.sync_cliente(os1, "444")
+    assert log.stale
+
+
+def test_ordini_evasi_parzialmente_contano_solo_il_residuo(store):
+    os1 = FakeOS1()
+    os1.docs["ordini"] = [
+        {"NumeroDocumento": "R1", "DataDocumento": "2024-01-10", "Totale": 100, "Stato": "inevaso"},
+        {"NumeroDocumento": "R2", "DataDocumento": "2024-01-11", "Totale": 200,
+         "Stato": "evaso parzialmente", "ImportoResiduo": 50},
+        {"NumeroDocumento": "R3", "DataDocumento": "2024-01-12", "Totale": 300,
+         "Stato": "evaso parzialmente"},
+    ]
+    store.sync_cliente(os1, "444")
+
+    ordini = store.get_kpi(os1, "444")["ordini_inevasi"]
+    assert ordini["numero"] == 3
+    assert ordini["totale_da_evadere"] == 150.0
+    assert ordini["evasi_parzialmente_senza_residuo"] == {"numero": 1, "valore_ordini": 300.0}
+    assert "nota" in ordini
+
+
+def test_get_kpi_attende_il_sync_in_corso(store):
+    os1 = FakeOS1()
+    os1.docs["offerte"] = [_offerta("O1", "inevaso")]
+    sync_in_corso, continua = threading.Event(), threading.Event()
+    filtra = os1._filtra
+
+    def filtra_lento(tipo, data_da):
+        sync_in_corso.set()
+        continua.wait(5)
+        return filtra(tipo, data_da)
+
+    os1._filtra = filtra_lento
+    refresh = threading.Thread(target=store.sync_cliente, args=(os1, "444"))
+    refresh.start()
+    sync_in_corso.wait(5)
+
+    risultato = {}
+    lettura = threading.Thread(target=lambda: risultato.update(store.get_kpi(os1, "444")))
+    lettura.start()
+    time.sleep(0.1)
+    continua.set()
+    refresh.join(5)
+    lettura.join(5)
+
+    assert "error" not in risultato
+    assert "_avviso" not in risultato
+    assert risultato["offerte_aperte"]["numero"] == 1
@@ -0,0 +1,241 @@
+"""
+Tools OS1 per Claude - Partner Data
+Registro unico dei tool: ogni funzione decorata con @tool definisce sia lo schema
+mandato a Claude (TOOLS) sia l'handler usato da execute_tool (dispatch per dizionario).
+"""
+
+import json
+import time
+
+TOOLS = []          # Schema tools per l'API Claude, nell'ordine di registrazione
+TOOL_HANDLERS = {}  # nome tool -> funzione(os1_client, tool_input)
+
+MAX_RESULT_CHARS = 50000
+MAX_RESULT_RECORDS = 30
+
+
+def tool(name, description, properties=None, required=()):
+    """Registra la funzione come tool Claude con il relativo input_schema."""
+    def register(func):
+        TOOLS.append({
+            "name": name,
+            "description": description,
+            "input_schema": {
+                "type": "object",
+                "properties": properties or {},
+                "required": list(required)
+            }
+        })
+        TOOL_HANDLERS[name] = func
+        return func
+    return register
+
+
+# Proprietà comuni degli input_schema
+ID_CLIENTE = {
+    "type": "string",
+    "description": "Codice numerico del cliente"
+}
+DATA_DA = {
+    "type": "string",
+    "description": "Data inizio periodo, formato YYYY-MM-DD (opzionale)"
+}
+DATA_A = {
+    "type": "string",
+    "description": "Data fine periodo, formato YYYY-MM-DD (opzionale)"
+}
+
+
+# ──────────────────────────────────────────────
+# DEFINIZIONE TOOLS
+# ──────────────────────────────────────────────
+
+@tool(
+    "cerca_cliente",
+    "Cerca un cliente nel database OS1 per nome, ragione sociale o codice numerico. "
+    "Usa questo tool quando l'utente menziona un cliente specifico e vuoi trovare "
+    "il suo codice o le sue informazioni anagrafiche. Restituisce una lista di clienti trovati.",
+    {
+        "query": {
+            "type": "string",
+            "description": "Nome, ragione sociale o codice numerico del cliente da cercare"
+        }
+    },
+    required=["query"]
+)
+def cerca_cliente(os1_client, tool_input):
+    return os1_client.cerca_cliente(tool_input["query"])
+
+
+@tool(
+    "get_dettaglio_cliente",
+    "Recupera i dettagli anagrafici completi di un cliente dato il suo codice numerico. "
+    "Usa questo quando hai già il codice cliente e vuoi i dati completi (indirizzo, contatti, ecc.).",
+    {
+        "id_cliente": {
+            "type": "string",
+            "description": "Codice numerico del cliente (es: '444')"
+        }
+    },
+    required=["id_cliente"]
+)
+def get_dettaglio_cliente(os1_client, tool_input):
+    return os1_client.get_cliente(tool_input["id_cliente"])
+
+
+@tool(
+    "get_offerte_cliente",
+    "Recupera le offerte/preventivi di un cliente dal gestionale OS1. "
+    "Usa questo quando l'utente chiede: offerte aperte, preventivi, prezzi offerti, "
+    "offerte da sollecitare, stato delle offerte. "
+    "Puoi filtrare per periodo con data_da e data_a.",
+    {"id_cliente": ID_CLIENTE, "data_da": DATA_DA, "data_a": DATA_A},
+    required=["id_cliente"]
+)
+def get_offerte_cliente(os1_client, tool_input):
+    return os1_client.get_offerte_cliente(
+        id_cliente=tool_input["id_cliente"],
+        data_da=tool_input.get("data_da"),
+        data_a=tool_input.get("data_a")
+    )
+
+
+@tool(
+    "get_ordini_cliente",
+    "Recupera gli ordini di un cliente dal gestionale OS1. "
+    "Usa questo quando l'utente chiede: ordini, stato ordini, date consegna, "
+    "ordini evasi o inevasi, storico ordini. "
+    "Puoi filtrare per periodo e per agente commerciale.",
+    {
+        "id_cliente": ID_CLIENTE,
+        "data_da": DATA_DA,
+        "data_a": DATA_A,
+        "id_agente": {
+            "type": "string",
+            "description": "Codice agente commerciale (opzionale)"
+        }
+    },
+    required=["id_cliente"]
+)
+def get_ordini_cliente(os1_client, tool_input):
+    return os1_client.get_ordini_cliente(
+        id_cliente=tool_input["id_cliente"],
+        data_da=tool_input.get("data_da"),
+        data_a=tool_input.get("data_a"),
+        id_agente=tool_input.get("id_agente")
+    )
+
+
+@tool(
+    "get_fatture_cliente",
+    "Recupera le fatture e note di credito di un cliente dal gestionale OS1. "
+    "Usa questo quando l'utente chiede: fatturato, fatture, importi, "
+    "analisi economica, quanto ha speso un cliente, volume d'affari. "
+    "Per calcolare il fatturato totale, somma gli importi delle fatture nel periodo.",
+    {"id_cliente": ID_CLIENTE, "data_da": DATA_DA, "data_a": DATA_A},
+    required=["id_cliente"]
+)
+def get_fatture_cliente(os1_client, tool_input):
+    return os1_client.get_fatture_cliente(
+        id_cliente=tool_input["id_cliente"],
+        data_da=tool_input.get("data_da"),
+        data_a=tool_input.get("data_a")
+    )
+
+
+@tool(
+    "get_bolle_cliente",
+    "Recupera i DDT (documenti di trasporto / bolle) di un cliente. "
+    "Usa questo quando l'utente chiede: consegne, spedizioni, date di consegna, DDT.",
+    {"id_cliente": ID_CLIENTE, "data_da": DATA_DA, "data_a": DATA_A},
+    required=["id_cliente"]
+)
+def get_bolle_cliente(os1_client, tool_input):
+    return os1_client.get_bolle_cliente(
+        id_cliente=tool_input["id_cliente"],
+        data_da=tool_input.get("data_da"),
+        data_a=tool_input.get("data_a")
+    )
+
+
+@tool(
+    "get_kpi_cliente",
+    "Restituisce all'istante i KPI pre-calcolati di un cliente: fatturato per anno e per mese, "
+    "offerte aperte (inevase) per fasce di anzianità con le più vecchie da sollecitare, "
+    "ordini inevasi o evasi parzialmente (totale_da_evadere = valore ancora da evadere; "
+    "gli evasi parzialmente senza residuo in OS1 sono a parte), data ultima consegna (DDT). "
+    "Usa questo PRIMA degli altri tool per domande su fatturato, offerte da sollecitare, "
+    "ordini inevasi. Il campo aggiornato_il indica quando sono stati calcolati.",
+    {
+        "id_cliente": ID_CLIENTE,
+        "anno": {
+            "type": "integer",
+            "description": "Limita il fatturato mensile a questo anno (opzionale)"
+        }
+    },
+    required=["id_cliente"]
+)
+def get_kpi_cliente(os1_client, tool_input):
+    # Import lazy: sqlite e il job di refresh servono solo quando il tool viene usato
+    from kpi_clienti import get_store
+    return get_store(os1_client).get_kpi(
+        os1_client,
+        tool_input["id_cliente"],
+        anno=tool_input.get("anno")
+    )
+
+
+@tool(
+    "lista_clienti",
+    "Recupera la lista di tutti i clienti nel database. "
+    "Usa solo se l'utente chiede esplicitamente di vedere tutti i clienti o una lista generale.",
+    {
+        "limit": {
+            "type": "integer",
+            "description": "Numero massimo di clienti da restituire (default: 20)",
+            "default": 20
+        }
+    }
+)
+def lista_clienti(os1_client, tool_input):
+    return os1_client.lista_clienti(limit=tool_input.get("limit", 20))
+
+
+# ──────────────────────────────────────────────
+# ESECUZIONE TOOLS
+# ──────────────────────────────────────────────
+
+def execute_tool(os1_client, tool_name, tool_input):
+    """Esegue il tool richiesto da Claude e restituisce il risultato."""
+    handler = TOOL_HANDLERS.get(tool_name)
+    if handler is None:
+        return json.dumps({"error": f"Tool sconosciuto: {tool_name}"})
+
+    os1_client.pop_stale_timestamp()  # azzera eventuali dati "vecchi" di tool precedenti
+    try:
+        result = handler(os1_client, tool_input)
+
+        # Tronca risultati troppo grandi per non superare il contesto di Claude
+        result_json = json.dumps(result, ensure_ascii=False, default=str)
+        if len(result_json) > MAX_RESULT_CHARS:
+            if isinstance(result, list):
+                totale = len(result)
+                result = result[:MAX_RESULT_RECORDS]
+                result.append({"_nota": f"Risultati troncati. Totale originale: {totale} record."})
+            result_json = json.dumps(result, ensure_ascii=False, default=str)
+
+        # OS1 non raggiungibile: i dati vengono dalla cache, segnala a Claude quanto sono vecchi
+        stale_at = os1_client.pop_stale_timestamp()
+        if stale_at is not None:
+            result_json = json.dumps({
+                "_avviso": "Gestionale OS1 non raggiungibile: dati dall'ultima lettura salvata",
+                "dati_aggiornati_al": time.strftime("%d/%m/%Y %H:%M", time.localtime(stale_at)),
+                "risultati": result
+            }, ensure_ascii=False, default=str)
+
+        return result_json
+
+    except ConnectionError as e:
+        return json.dumps({"error": str(e)})
+    except Exception as e:
+        return json.dumps({"error": f"Errore durante {tool_name}: {str(e)}"})